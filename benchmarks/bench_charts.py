@@ -0,0 +1,239 @@
+""" benchmark the javascript generation of the Bokeh PyLinkJS plugin across chart types and data sizes
+
+    Every chart type is created and then updated twice through a fake pyLinkJS context.  The first update
+    draws the chart, the second update sends new data for a chart already on the page.  Each step reports the
+    wall time, the peak memory allocated in python and the number of javascript bytes sent to the browser.
+
+    i.e.
+        python benchmarks/bench_charts.py --rows 1000 100000 --cols 1 10 --output before.json
+        python benchmarks/bench_charts.py --rows 1000 100000 --cols 1 10 --compare before.json
+"""
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import bokeh
+
+# run against the source checkout this script is in, not an installed copy of the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pyLinkJS_Bokeh.bokehPlugin import pluginBokeh
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+CHART_TYPES = ['line', 'pie', 'hbar', 'vbar', 'varea', 'table', 'histogram', 'boxplot']
+DEFAULT_ROWS = [100, 10000, 100000]
+DEFAULT_COLS = [1, 10, 50]
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class fakeJSC:
+    """ pyLinkJS context which records the javascript sent to the browser instead of sending it """
+    def __init__(self, page_instance_id):
+        self.page_instance_id = page_instance_id
+        self.js_bytes = 0
+
+    def eval_js_code(self, js, blocking=False):
+        self.js_bytes = self.js_bytes + len(js.encode())
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def create_df(chart_type, rows, cols, rng):
+    """ create a random dataframe in the form the chart type expects
+
+        Args:
+            chart_type - type of the chart, i.e. 'line'
+            rows - number of rows of data, the number of bins for a histogram
+            cols - number of columns of data, the number of slices for a pie chart
+            rng - numpy random generator
+
+        Returns:
+            dataframe for the chart
+    """
+    columns = [f'C{i}' for i in range(cols)]
+    if chart_type == 'pie':
+        return pd.DataFrame(rng.integers(1, 100, size=(1, cols)), index=['value'], columns=columns)
+    if chart_type == 'histogram':
+        counts = rng.integers(0, 100, size=rows)
+        return pd.DataFrame({'counts': counts, 'bin_text': counts.astype(str)}, index=[f'B{i}' for i in range(rows)])
+    return pd.DataFrame(rng.integers(0, 100, size=(rows, cols)), columns=columns)
+
+
+def measure(func, repeat):
+    """ measure a function
+
+        Args:
+            func - function to measure, called with no arguments and returns the number of javascript bytes
+            repeat - number of times to time the function, the fastest time is reported
+
+        Returns:
+            dictionary of the results
+                'seconds' - fastest wall time
+                'peak_bytes' - peak memory allocated while running the function, measured in a separate run
+                               because tracing slows down the function
+                'js_bytes' - number of javascript bytes sent to the browser
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        js_bytes = func()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': min(seconds), 'peak_bytes': peak_bytes, 'js_bytes': js_bytes}
+
+
+def bench_chart(plugin, chart_type, rows, cols, repeat, rng):
+    """ benchmark creating a chart, drawing it and updating it with new data
+
+        Args:
+            plugin - pluginBokeh instance
+            chart_type - type of the chart, i.e. 'line'
+            rows - number of rows of data
+            cols - number of columns of data
+            repeat - number of times to time each step
+            rng - numpy random generator
+
+        Returns:
+            list of result dictionaries, one per step
+    """
+    df_first = create_df(chart_type, rows, cols, rng)
+    df_second = create_df(chart_type, rows, cols, rng)
+    jsc = fakeJSC(f'bench_{chart_type}_{rows}_{cols}')
+
+    def create():
+        # chart creation errors are turned into a message in the html, a failed create must not look like a fast one
+        html = plugin._create_chart(chart_type, jsc.page_instance_id, name='chart')
+        if 'Unable to create chart' in html:
+            raise RuntimeError(f'Unable to create {chart_type} chart')
+        return len(html.encode())
+
+    def draw():
+        create()
+        jsc.js_bytes = 0
+        plugin._update_chart(jsc, 'chart', df_first)
+        return jsc.js_bytes
+
+    def update():
+        jsc.js_bytes = 0
+        plugin._update_chart(jsc, 'chart', df_second)
+        plugin._update_chart(jsc, 'chart', df_first)
+        return jsc.js_bytes // 2
+
+    results = []
+    for step, func in (('create', create), ('draw', draw), ('update', update)):
+        if step == 'update':
+            draw()
+        r = {'chart_type': chart_type, 'rows': rows, 'cols': cols, 'step': step}
+        r.update(measure(func, repeat))
+        results.append(r)
+    plugin.on_context_close(jsc)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ print the steps which got slower or larger than the baseline
+
+        Args:
+            results - list of result dictionaries from this run
+            baseline - list of result dictionaries from an earlier run
+            threshold - ratio above which a step is reported, i.e. 1.2 for 20% slower
+
+        Returns:
+            number of regressions found
+    """
+    def key(r):
+        return (r['chart_type'], r['rows'], r['cols'], r['step'])
+
+    baseline = {key(r): r for r in baseline}
+    regressions = 0
+    for r in results:
+        b = baseline.get(key(r), None)
+        if b is None:
+            continue
+        for m in ('seconds', 'peak_bytes', 'js_bytes'):
+            if (b[m] > 0) and (r[m] / b[m] > threshold):
+                regressions = regressions + 1
+                print(f'{"/".join([str(x) for x in key(r)])} {m}: {b[m]} -> {r[m]} ({r[m] / b[m]:.2f}x)',
+                      file=sys.stderr)
+    return regressions
+
+
+def run(args):
+    """ run the benchmark
+
+        Args:
+            args - parsed command line arguments
+
+        Returns:
+            exit code, 1 if regressions were found when comparing against a baseline
+    """
+    plugin = pluginBokeh()
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    for chart_type in args.charts:
+        for rows in args.rows:
+            for cols in args.cols:
+                for r in bench_chart(plugin, chart_type, rows, cols, args.repeat, rng):
+                    print(f"{r['chart_type']:>10} {r['rows']:>8} {r['cols']:>4} {r['step']:>7} "
+                          f"{r['seconds']:10.4f}s {r['peak_bytes']:>12,}B peak {r['js_bytes']:>12,}B js",
+                          file=sys.stderr)
+                    results.append(r)
+
+    output = {'timestamp': datetime.datetime.now().isoformat(),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'numpy': np.__version__,
+              'bokeh': bokeh.__version__,
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=1)
+    else:
+        print(json.dumps(output, indent=1))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold) > 0:
+            return 1
+    return 0
+
+
+# --------------------------------------------------
+#    Main
+# --------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the javascript generation of the Bokeh plugin')
+    parser.add_argument('--charts', nargs='+', default=CHART_TYPES, choices=CHART_TYPES, help='chart types to run')
+    parser.add_argument('--rows', nargs='+', type=int, default=DEFAULT_ROWS, help='numbers of rows to run')
+    parser.add_argument('--cols', nargs='+', type=int, default=DEFAULT_COLS, help='numbers of columns to run')
+    parser.add_argument('--repeat', type=int, default=3, help='number of times to time each step')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the random data')
+    parser.add_argument('--output', help='write the results as json to this file instead of stdout')
+    parser.add_argument('--compare', help='json results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='ratio to the earlier run above which a step is reported as a regression')
+    sys.exit(run(parser.parse_args()))
@@ -18,28 +18,18 @@ def refresh_charts(jsc, columns = 3):
     df = pd.DataFrame(np.random.randint(0,100,size=(rows, columns)), columns=column_headers)
 
     jsc['#chart_line_df'].html = df.to_string()
-    jsc.update_chart('chart_line', df)
-    jsc['#chart_pie_df'].html = df.head(1).to_string()
-    jsc.update_chart('chart_pie', df.head(1))
     jsc['#chart_hbar1_df'].html = df.head(1).to_string()
-    jsc.update_chart('chart_hbar1', df.head(1))
     jsc['#chart_hbar_df'].html = df.to_string()
-    jsc.update_chart('chart_hbar', df)
     jsc['#chart_vbar1_df'].html = df.head(1).to_string()
-    jsc.update_chart('chart_vbar1', df.head(1))
     jsc['#chart_vbar_df'].html = df.to_string()
-    jsc.update_chart('chart_vbar', df)
     jsc['#chart_table_df'].html = df.to_string()
-    jsc.update_chart('chart_table', df)
     jsc['#chart_boxplot_df'].html = df.to_string()
-    jsc.update_chart('chart_boxplot', df)
 
     # special for pie chart
     df_pie = df.head(1).copy()
     for c in df_pie.columns:
         df_pie.loc['text', c] = c + ' ' + c
     jsc['#chart_pie_df'].html = df_pie.to_string()
-    jsc.update_chart('chart_pie', df_pie)
     
     # histogram data and update
     bins = list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'[:columns])
@@ -48,9 +38,18 @@ def refresh_charts(jsc, columns = 3):
         df_hist.loc[b, 'counts'] = np.random.randint(0, 100)
         df_hist.loc[b, 'bin_text'] = b + ' ' + b
     df_hist['counts'] = df_hist['counts'].astype('int')     
-    
     jsc['#chart_histogram_df'].html = df_hist.to_string()
-    jsc.update_chart('chart_histogram', df_hist)
+
+    # update all of the charts in one message
+    jsc.update_charts({'chart_line': df,
+                       'chart_pie': df_pie,
+                       'chart_hbar1': df.head(1),
+                       'chart_hbar': df,
+                       'chart_vbar1': df.head(1),
+                       'chart_vbar': df,
+                       'chart_table': df,
+                       'chart_boxplot': df,
+                       'chart_histogram': df_hist})
     
 
 def ready(jsc, *args):
@@ -3,12 +3,21 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
-import inspect
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import functools
 import logging
+import threading
 import time
 import pandas as pd
+import bokeh
 import bokeh.models
 import bokeh.plotting
+import bokeh.util.paths
+from .bokehPlugin_scheduler import current_io_loop, updateScheduler
+from .bokehPlugin_stats import LATENCY_JS, statsCollector
 from .bokehPlugin_util import promote_kwargs_prefix, configure_color_palette, post_process_figure
 from .bokehPlugin_blank_chart import create_chart_js as create_blank_chart_js
 from .bokehPlugin_blank_chart import update_chart_js as update_blank_chart_js
@@ -18,14 +27,37 @@ from .bokehPlugin_hbar_chart import create_chart_js as create_hbar_chart_js
 from .bokehPlugin_hbar_chart import update_chart_js as update_hbar_chart_js
 from .bokehPlugin_line_chart import create_chart_js as create_line_chart_js
 from .bokehPlugin_line_chart import update_chart_js as update_line_chart_js
+from .bokehPlugin_line_chart import stream_chart_js as stream_line_chart_js
 from .bokehPlugin_pie_chart import create_chart_js as create_pie_chart_js
 from .bokehPlugin_pie_chart import update_chart_js as update_pie_chart_js
 from .bokehPlugin_vbar_chart import create_chart_js as create_vbar_chart_js
 from .bokehPlugin_vbar_chart import update_chart_js as update_vbar_chart_js
+from .bokehPlugin_varea_chart import create_chart_js as create_varea_chart_js
+from .bokehPlugin_varea_chart import update_chart_js as update_varea_chart_js
+from .bokehPlugin_varea_chart import stream_chart_js as stream_varea_chart_js
 from .bokehPlugin_histogram_chart import create_chart_js as create_histogram_chart_js
 from .bokehPlugin_histogram_chart import update_chart_js as update_histogram_chart_js
+from .bokehPlugin_histogram_chart import prepare_chart_df as prepare_histogram_chart_df
 from .bokehPlugin_table_chart import create_chart_js as create_table_chart_js
 from .bokehPlugin_table_chart import update_chart_js as update_table_chart_js
+from .bokehPlugin_table_chart import table_callback_js
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def bokeh_callback(jsc, action, *args):
+    """ called from the browser with call_py('bokeh_callback', action, ...) by the charts which need the server
+
+        The application must import this function so pyLinkJS can find it, i.e.
+            from pyLinkJS_Bokeh.bokehPlugin import pluginBokeh, bokeh_callback
+
+        Args:
+            jsc - pyLinkJS context
+            action - name of the action, i.e. 'table_page'
+            args - arguments for the action
+    """
+    pluginBokeh._bokeh_callback(jsc, action, *args)
+
 
 # --------------------------------------------------
 #    Plugin
@@ -38,22 +70,64 @@ class obj:
         return str(self._s)
 
 
+class preparedValues(dict):
+    """ dictionary of prepared values for a chart, the values which are expensive and not needed by every chart
+        type are computed on first access
+
+            'palette' - color palette for the columns of the dataframe
+            'cds' - ColumnDataSource of the dataframe
+    """
+    def __missing__(self, key):
+        if key == 'palette':
+            value = configure_color_palette(self['df'], self['kwargs'].get('user_palette', None))
+        elif key == 'cds':
+            value = bokeh.models.ColumnDataSource(bokeh.models.ColumnDataSource.from_df(self['df']))
+        else:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+
 class bokehChart:
-    def __init__(self, jsc, chart_name):
+    def __init__(self, jsc, chart_name, doc_index=None, deferred=False, flush_bytes=256 * 1024, flush_ms=100):
+        """ init
+
+            Args:
+                jsc - pyLinkJS context
+                chart_name - name of the chart
+                doc_index - index of the chart in Bokeh.documents if already known
+                deferred - if True, do not look up the chart now, instead the browser looks up the chart when
+                           the commands sent by this object run
+                flush_bytes - while holding, send the buffered commands once they are larger than this
+                flush_ms - while holding, send the buffered commands once the oldest is older than this.  The
+                           commands are sent by a timer on the IOLoop, so if the commands are queued from a
+                           thread without an IOLoop they are only sent when the next command is queued
+        """
         self._chart_name = chart_name
         self._jsc = jsc
 
-        js = f"""var index=-1; for (var i=0; i<Bokeh.documents.length;i++) {{if (Bokeh.documents[i].get_model_by_name('{chart_name}')) {{index=i;}};}}; index"""
-        self._doc_index = jsc.eval_js_code(js)
-        if self._doc_index == -1:
-            raise Exception('Chart not found in Bokeh Documents')
+        self._doc_index = doc_index
+        if deferred:
+            self._js_doc = f"""Bokeh.documents.find((d) => d.get_model_by_name('{chart_name}') != null)"""
+        else:
+            if self._doc_index is None:
+                js = f"""var index=-1; for (var i=0; i<Bokeh.documents.length;i++) {{if (Bokeh.documents[i].get_model_by_name('{chart_name}')) {{index=i;}};}}; index"""
+                self._doc_index = jsc.eval_js_code(js)
+                if self._doc_index == -1:
+                    raise Exception('Chart not found in Bokeh Documents')
+            self._js_doc = f"""Bokeh.documents[{self._doc_index}]"""
 
-        self._js_chart = f"""Bokeh.documents[{self._doc_index}].get_model_by_name('{self._chart_name}')"""
+        self._js_chart = f"""{self._js_doc}.get_model_by_name('{self._chart_name}')"""
         self._palette = ['#006ddb', '#db6d00', '#22cf22', '#920000', '#490092',
                          '#8f4e00', '#ff6db6', '#676767', '#004949', '#009999']
         self._color_index = {}
         self._hold = False
-        self._js = ''
+        self._js = []
+        self._js_len = 0
+        self._js_start = 0
+        self._flush_bytes = flush_bytes
+        self._flush_ms = flush_ms
+        self._flush_timer = None
 
     def _dict_to_js_map(self, d):
         s = []
@@ -88,26 +162,32 @@ class bokehChart:
         if legend_label is not None:
             js += f"""
                 var lio = new Bokeh.LegendItem({{label: '{legend_label}'}});
-                lio.renderers.push(Bokeh.documents[{self._doc_index}].get_model_by_name('{kwargs['name']}'));
+                lio.renderers.push({self._js_doc}.get_model_by_name('{kwargs['name']}'));
                 {self._js_chart}.legend.items.push(lio);
                 {self._js_chart}.change.emit();
                 {self._js_chart}.legend.change.emit();
             """
 
-        self._js += js
-        if not self._hold:
-            self._jsc.eval_js_code(self._js, blocking=False)
-            self._js = ''
+        self._queue_js(js)
+
+    def _queue_js(self, js):
+        """ buffer javascript, and send the buffer if not holding or a flush threshold was passed """
+        if len(self._js) == 0:
+            self._js_start = time.monotonic()
+            if self._hold:
+                self._start_flush_timer()
+        self._js.append(js)
+        self._js_len = self._js_len + len(js)
+
+        if ((not self._hold) or (self._js_len >= self._flush_bytes) or
+                ((time.monotonic() - self._js_start) * 1000 >= self._flush_ms)):
+            self.flush()
 
     def exec_js(self, js, global_scope=False):
         if not global_scope:
-            self._js += self._js_chart + '.' + js + ';\n'
+            self._queue_js(self._js_chart + '.' + js + ';\n')
         else:
-            self._js += js + ';\n'
-
-        if not self._hold:
-            self._jsc.eval_js_code(self._js, blocking=False)
-            self._js = ''
+            self._queue_js(js + ';\n')
 
     def annotate_box(self, **kwargs):
         self.exec_js(f'add_layout(new Bokeh.BoxAnnotation({{{self._dict_to_js_map(kwargs)}}}))')
@@ -123,78 +203,114 @@ class bokehChart:
         js = f"""{cds_name} = new Bokeh.ColumnDataSource({{'data': JSON.parse('{cds_data_json}')}}); 0;\n"""
         self.exec_js(js, global_scope=True)
 
+    @contextlib.contextmanager
+    def batch(self):
+        """ hold the commands inside the with block and send them together, i.e.
+
+                with chart.batch():
+                    chart.circle(x=[0], y=[0])
+                    chart.circle(x=[1], y=[1])
+        """
+        hold = self._hold
+        self.hold()
+        try:
+            yield self
+        finally:
+            if not hold:
+                self.unhold()
+
+    def _start_flush_timer(self):
+        """ send the buffered commands after flush_ms even if no more commands are queued """
+        io_loop = current_io_loop()
+        if (io_loop is not None) and (self._flush_timer is None):
+            self._flush_timer = (io_loop, io_loop.call_later(self._flush_ms / 1000, self._on_flush_timer))
+
+    def _on_flush_timer(self):
+        """ called by the IOLoop when the flush timer expires """
+        self._flush_timer = None
+        self.flush()
+
+    def flush(self):
+        """ send the buffered commands to the browser """
+        if self._flush_timer is not None:
+            io_loop, timeout = self._flush_timer
+            self._flush_timer = None
+            io_loop.remove_timeout(timeout)
+        if len(self._js) > 0:
+            self._jsc.eval_js_code(pluginBokeh._latency_js(self._jsc, self._chart_name, ''.join(self._js)),
+                                   blocking=False)
+            self._js = []
+            self._js_len = 0
+
     def hold(self):
         self._hold = True
 
     def unhold(self):
         self._hold = False
-        if self._js != '':
-            print(self._js)
-            self._jsc.eval_js_code(self._js, blocking=False)
-            self._js = ''
+        self.flush()
 
     def js_chart_accessor(self):
         return self._js_chart
 
-    def annular_wedge(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def annulus(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def arc(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def asterisk(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def bezier(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def circle(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def circle_cross(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def circle_dot(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def circle_x(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def circle_y(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def cross(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def dash(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def diamond(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def diamond_cross(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def diamond_dot(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def dot(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def ellipse(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def harea(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def harea_step(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def hbar(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def hex(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def hex_tile(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def hstrip(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def hspan(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def image(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def image_rgba(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def image_url(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def inverted_triangle(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def line(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def multi_line(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def multi_polygons(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def patch(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def patches(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def plus(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def quad(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def quadratic(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def ray(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def rect(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def segment(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def square(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def square_cross(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def square_dot(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def square_pin(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def square_x(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def star(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def star_dot(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def step(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def text(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def triangle(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def triangle_dot(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def triangle_pin(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def varea(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def varea_step(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def vbar(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def vstrip(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def vspan(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def wedge(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def x(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
-    def y(self, **kwargs): self._add_figure_object(inspect.currentframe().f_code.co_name, **kwargs)
+    annular_wedge = functools.partialmethod(_add_figure_object, 'annular_wedge')
+    annulus = functools.partialmethod(_add_figure_object, 'annulus')
+    arc = functools.partialmethod(_add_figure_object, 'arc')
+    asterisk = functools.partialmethod(_add_figure_object, 'asterisk')
+    bezier = functools.partialmethod(_add_figure_object, 'bezier')
+    circle = functools.partialmethod(_add_figure_object, 'circle')
+    circle_cross = functools.partialmethod(_add_figure_object, 'circle_cross')
+    circle_dot = functools.partialmethod(_add_figure_object, 'circle_dot')
+    circle_x = functools.partialmethod(_add_figure_object, 'circle_x')
+    circle_y = functools.partialmethod(_add_figure_object, 'circle_y')
+    cross = functools.partialmethod(_add_figure_object, 'cross')
+    dash = functools.partialmethod(_add_figure_object, 'dash')
+    diamond = functools.partialmethod(_add_figure_object, 'diamond')
+    diamond_cross = functools.partialmethod(_add_figure_object, 'diamond_cross')
+    diamond_dot = functools.partialmethod(_add_figure_object, 'diamond_dot')
+    dot = functools.partialmethod(_add_figure_object, 'dot')
+    ellipse = functools.partialmethod(_add_figure_object, 'ellipse')
+    harea = functools.partialmethod(_add_figure_object, 'harea')
+    harea_step = functools.partialmethod(_add_figure_object, 'harea_step')
+    hbar = functools.partialmethod(_add_figure_object, 'hbar')
+    hex = functools.partialmethod(_add_figure_object, 'hex')
+    hex_tile = functools.partialmethod(_add_figure_object, 'hex_tile')
+    hstrip = functools.partialmethod(_add_figure_object, 'hstrip')
+    hspan = functools.partialmethod(_add_figure_object, 'hspan')
+    image = functools.partialmethod(_add_figure_object, 'image')
+    image_rgba = functools.partialmethod(_add_figure_object, 'image_rgba')
+    image_url = functools.partialmethod(_add_figure_object, 'image_url')
+    inverted_triangle = functools.partialmethod(_add_figure_object, 'inverted_triangle')
+    line = functools.partialmethod(_add_figure_object, 'line')
+    multi_line = functools.partialmethod(_add_figure_object, 'multi_line')
+    multi_polygons = functools.partialmethod(_add_figure_object, 'multi_polygons')
+    patch = functools.partialmethod(_add_figure_object, 'patch')
+    patches = functools.partialmethod(_add_figure_object, 'patches')
+    plus = functools.partialmethod(_add_figure_object, 'plus')
+    quad = functools.partialmethod(_add_figure_object, 'quad')
+    quadratic = functools.partialmethod(_add_figure_object, 'quadratic')
+    ray = functools.partialmethod(_add_figure_object, 'ray')
+    rect = functools.partialmethod(_add_figure_object, 'rect')
+    segment = functools.partialmethod(_add_figure_object, 'segment')
+    square = functools.partialmethod(_add_figure_object, 'square')
+    square_cross = functools.partialmethod(_add_figure_object, 'square_cross')
+    square_dot = functools.partialmethod(_add_figure_object, 'square_dot')
+    square_pin = functools.partialmethod(_add_figure_object, 'square_pin')
+    square_x = functools.partialmethod(_add_figure_object, 'square_x')
+    star = functools.partialmethod(_add_figure_object, 'star')
+    star_dot = functools.partialmethod(_add_figure_object, 'star_dot')
+    step = functools.partialmethod(_add_figure_object, 'step')
+    text = functools.partialmethod(_add_figure_object, 'text')
+    triangle = functools.partialmethod(_add_figure_object, 'triangle')
+    triangle_dot = functools.partialmethod(_add_figure_object, 'triangle_dot')
+    triangle_pin = functools.partialmethod(_add_figure_object, 'triangle_pin')
+    varea = functools.partialmethod(_add_figure_object, 'varea')
+    varea_step = functools.partialmethod(_add_figure_object, 'varea_step')
+    vbar = functools.partialmethod(_add_figure_object, 'vbar')
+    vstrip = functools.partialmethod(_add_figure_object, 'vstrip')
+    vspan = functools.partialmethod(_add_figure_object, 'vspan')
+    wedge = functools.partialmethod(_add_figure_object, 'wedge')
+    x = functools.partialmethod(_add_figure_object, 'x')
+    y = functools.partialmethod(_add_figure_object, 'y')
 
 
 class pluginBokeh:
@@ -202,33 +318,87 @@ class pluginBokeh:
     # --------------------------------------------------
     #    Class Variables
     # --------------------------------------------------
-    BOKEH_CONTEXT = {}
+    BOKEH_CONTEXT = collections.OrderedDict()         # page_instance_id -> page context, least recently used first
+    BOKEH_CONTEXT_TTL = 24 * 60 * 60                   # seconds a page context may sit idle before it is evicted
+    BOKEH_CONTEXT_MAX_SIZE = 1000                      # maximum number of page contexts kept
+    BOKEH_CONTEXT_EVICTIONS = {'close': 0, 'ttl': 0, 'size': 0}
+    _BOKEH_CONTEXT_LOCK = threading.RLock()
+    BOKEH_JS_CDN_VERSION = '3.1.1'                     # version of BokehJS loaded from the CDN
+    BOKEH_JS_LOCAL_URL_PREFIX = '/bokeh_static/'       # url BokehJS is served from by the plugin
+    CHART_TYPE_BUNDLES = {'table': ['bokeh-widgets', 'bokeh-tables']}   # BokehJS bundles needed by chart type
+    BOKEH_STATS = None                                 # statsCollector when statistics are enabled
+    _TARGETCLASS_ATTRIBUTES = {}                       # target class -> public attribute names
+    _SCHEDULER = None                                  # updateScheduler of the plugin when updates are coalesced
 
     # --------------------------------------------------
     #    Constructor and Plugin Registration
     # --------------------------------------------------
-    def __init__(self, get_data_handler=None):
-        """ init """
+    def __init__(self, get_data_handler=None, max_update_hz=None, context_ttl=24 * 60 * 60, context_max_size=1000,
+                 resources='cdn', stats=False, async_workers=4):
+        """ init
+
+            Args:
+                get_data_handler - not used
+                max_update_hz - if set, updates to each chart are coalesced so at most this many updates per
+                                second are sent to the browser for each chart.  Superseded updates are dropped
+                                and only the latest update is sent
+                context_ttl - seconds a page context may sit idle before it is evicted, sets BOKEH_CONTEXT_TTL
+                context_max_size - maximum number of page contexts kept, sets BOKEH_CONTEXT_MAX_SIZE
+                resources - 'cdn' to load BokehJS from cdn.bokeh.org
+                            'local' to serve BokehJS from the installed bokeh package
+                stats - if True, collect statistics on the updates of each chart, see get_bokeh_stats
+                async_workers - number of threads which prepare the updates sent with update_chart_async
+        """
         self._get_data_handler = get_data_handler
+        self._resources = resources
+
+        # the page contexts are shared by the class, so every plugin created replaces the settings of the last one
+        pluginBokeh.BOKEH_CONTEXT_TTL = context_ttl
+        pluginBokeh.BOKEH_CONTEXT_MAX_SIZE = context_max_size
+        pluginBokeh.BOKEH_STATS = statsCollector() if stats else None
+        self._scheduler = None
+        if max_update_hz is not None:
+            self._scheduler = updateScheduler(self._send_chart_updates, max_update_hz,
+                                              prepare_func=self._prepare_chart_df)
+        pluginBokeh._SCHEDULER = self._scheduler
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=async_workers,
+                                                               thread_name_prefix='bokeh_update')
         self._kwargs = {
             'global_template_vars': {'create_chart': self._create_chart}
             }
         self.jsc_exposed_funcs = {'add_custom_chart_type': self.add_custom_chart_type,
                                   'get_bokeh_chart': self.get_bokeh_chart,
-                                  'update_chart': self._update_chart}
+                                  'get_bokeh_stats': self.get_bokeh_stats,
+                                  'stream_chart': self._stream_chart if self._scheduler is None else self._stream_chart_coalesced,
+                                  'update_chart': self._update_chart if self._scheduler is None else self._scheduler.submit,
+                                  'update_chart_async': self._update_chart_async,
+                                  'update_charts': self._update_charts if self._scheduler is None else self._scheduler.submit_many}
 
     def inject_html_top(self):
-        return """
+        """ the core BokehJS bundles are always loaded, the rest are loaded by create_chart when needed """
+        return f"""
             <head>
             <!-- bokeh -->
-            <script src="https://cdn.bokeh.org/bokeh/release/bokeh-3.1.1.min.js" crossorigin="anonymous"></script>
-            <script src="https://cdn.bokeh.org/bokeh/release/bokeh-widgets-3.1.1.min.js" crossorigin="anonymous"></script>
-            <script src="https://cdn.bokeh.org/bokeh/release/bokeh-tables-3.1.1.min.js" crossorigin="anonymous"></script>
-            <script src="https://cdn.bokeh.org/bokeh/release/bokeh-api-3.1.1.min.js" crossorigin="anonymous"></script>
-            <script src="https://cdn.bokeh.org/bokeh/release/bokeh-gl-3.1.1.min.js" crossorigin="anonymous"></script>
-            <script src="https://cdn.bokeh.org/bokeh/release/bokeh-mathjax-3.1.1.min.js" crossorigin="anonymous"></script>
+            {self._bundle_script('bokeh')}
+            {self._bundle_script('bokeh-api')}
+            {'' if self.BOKEH_STATS is None else f'<script>{LATENCY_JS}</script>'}
             </head>"""
 
+    def _bundle_script(self, bundle):
+        """ return the script tag to load a BokehJS bundle
+
+            Args:
+                bundle - name of the bundle, i.e. 'bokeh-tables'
+
+            Returns:
+                html script tag
+        """
+        if self._resources == 'local':
+            # the version query string makes tornado send long lived cache headers
+            src = f'{self.BOKEH_JS_LOCAL_URL_PREFIX}js/{bundle}.min.js?v={bokeh.__version__}'
+            return f"""<script src="{src}"></script>"""
+        src = f'https://cdn.bokeh.org/bokeh/release/{bundle}-{self.BOKEH_JS_CDN_VERSION}.min.js'
+        return f"""<script src="{src}" crossorigin="anonymous"></script>"""
 
     def register(self, kwargs):
         """ callback to register this plugin with the framework """
@@ -238,17 +408,96 @@ class pluginBokeh:
         self._kwargs['global_template_vars'] = d
         kwargs.update(self._kwargs)
 
+        # serve BokehJS from the installed bokeh package using the tornado static file handler
+        if self._resources == 'local':
+            if 'static_path' in kwargs:
+                logging.warning('static_path is already set, loading BokehJS from the CDN instead')
+                self._resources = 'cdn'
+            else:
+                kwargs['static_path'] = str(bokeh.util.paths.bokehjs_path())
+                kwargs['static_url_prefix'] = self.BOKEH_JS_LOCAL_URL_PREFIX
+
     # --------------------------------------------------
     #    Event Handlers
     # --------------------------------------------------
-    # @classmethod
-    # def on_context_close(cls, jsc):
-    #     pass
-    #
+    def on_context_close(self, jsc):
+        """ called when a page disconnects, evict the context for the page """
+        with self._BOKEH_CONTEXT_LOCK:
+            if self.BOKEH_CONTEXT.pop(jsc.page_instance_id, None) is not None:
+                self.BOKEH_CONTEXT_EVICTIONS['close'] += 1
+        self._discard_page(jsc.page_instance_id)
+
     # @classmethod
     # def on_context_open(cls, jsc):
     #     pass
 
+    # --------------------------------------------------
+    #    Context
+    # --------------------------------------------------
+    @classmethod
+    def _get_page_context(cls, page_instance_id, create=False):
+        """ return the context for a page and mark it as recently used
+
+            Page contexts which have been idle for longer than BOKEH_CONTEXT_TTL are evicted, and the least
+            recently used page contexts are evicted when there are more than BOKEH_CONTEXT_MAX_SIZE
+
+            Args:
+                page_instance_id - id of the page
+                create - if True, create the context if it does not exist
+
+            Returns:
+                dictionary of the page context, or None if the page has no context
+                    'kwargs' - dictionary of chart name to the kwargs the chart was created with
+                    'state' - dictionary of chart name to the state kept for the chart between updates
+                    'doc_index' - dictionary of chart name to the index of the chart in Bokeh.documents
+                    'bundles' - set of the extra BokehJS bundles loaded on the page
+                    'order' - dictionary of chart name to the lock, latest sequence number and the messages
+                              queued on the IOLoop which keep the updates of the chart in order, see _chart_order
+                    'last_access' - time.monotonic() of the last access
+        """
+        evicted = []
+        with cls._BOKEH_CONTEXT_LOCK:
+            now = time.monotonic()
+
+            # evict idle pages, the least recently used pages are first
+            while len(cls.BOKEH_CONTEXT) > 0:
+                oldest = next(iter(cls.BOKEH_CONTEXT.values()))
+                if now - oldest['last_access'] <= cls.BOKEH_CONTEXT_TTL:
+                    break
+                evicted.append(cls.BOKEH_CONTEXT.popitem(last=False)[0])
+                cls.BOKEH_CONTEXT_EVICTIONS['ttl'] += 1
+
+            # find or create the page context
+            page_context = cls.BOKEH_CONTEXT.get(page_instance_id, None)
+            if (page_context is None) and create:
+                page_context = {'kwargs': {}, 'state': {}, 'doc_index': {}, 'bundles': set(), 'order': {}}
+                cls.BOKEH_CONTEXT[page_instance_id] = page_context
+            if page_context is not None:
+                page_context['last_access'] = now
+                cls.BOKEH_CONTEXT.move_to_end(page_instance_id)
+
+            # evict the least recently used pages
+            while len(cls.BOKEH_CONTEXT) > cls.BOKEH_CONTEXT_MAX_SIZE:
+                evicted.append(cls.BOKEH_CONTEXT.popitem(last=False)[0])
+                cls.BOKEH_CONTEXT_EVICTIONS['size'] += 1
+
+        # drop what is still kept for the evicted pages outside of the page context lock
+        for evicted_page_instance_id in evicted:
+            cls._discard_page(evicted_page_instance_id)
+        return page_context
+
+    @classmethod
+    def _discard_page(cls, page_instance_id):
+        """ drop the pending updates and statistics kept for a page whose context was evicted or closed
+
+            Args:
+                page_instance_id - id of the page
+        """
+        if cls._SCHEDULER is not None:
+            cls._SCHEDULER.discard(page_instance_id)
+        if cls.BOKEH_STATS is not None:
+            cls.BOKEH_STATS.discard(page_instance_id)
+
 
     @classmethod
     def _extract_targetclass_kwargs(cls, targetclass, kwargs, delete=False):
@@ -262,27 +511,40 @@ class pluginBokeh:
             Returns:
                 dictionary of matched key values
         """
+        # the attributes of the target class are only looked up once
+        attributes = cls._TARGETCLASS_ATTRIBUTES.get(targetclass, None)
+        if attributes is None:
+            attributes = frozenset(k for k in dir(targetclass) if not k.startswith('_'))
+            cls._TARGETCLASS_ATTRIBUTES[targetclass] = attributes
+
         params = {}
-        for k in dir(targetclass):
-            if (not k.startswith('_')) and (k in kwargs):
-                params[k] = kwargs[k]
-                if delete:
-                    del kwargs[k]
+        for k in sorted(attributes.intersection(kwargs)):
+            params[k] = kwargs[k]
+            if delete:
+                del kwargs[k]
         return params
 
     @classmethod
-    def _prep_for_chart(cls, **kwargs):
+    def _prep_for_chart(cls, state=None, **kwargs):
         """ perform common preprocessing before creating a chart
 
+            The dataframe is not copied, only a shallow copy is made to set the index and column names.  Chart
+            types must not modify pv['df'] in place, and must take a copy of it to keep it in the state
+
+            Args:
+                state - dictionary of state kept for the chart between updates, used to cache values which only
+                        depend on the columns of the dataframe and the kwargs.  None to start an empty state
+
             Kwargs:
                 df - dataframe containing the data for the chart
 #                title - title of the figure, shorthand for __figure__title
                 user_palette - palette for glyphs in the chart
 
             Returns:
-                dictionary of processed variables necessary for chart generation
-                    palette - generate color palette for the chart
-                    cds - ColumnDataSource for the chart
+                preparedValues dictionary of processed variables necessary for chart generation
+                    palette - generate color palette for the chart, computed on first access
+                    cds - ColumnDataSource for the chart, computed on first access
+                    state - the state passed in, always present
         """
         # fix kwargs
 #        kwargs['title'] = kwargs.get('title', '')
@@ -290,33 +552,34 @@ class pluginBokeh:
         kwargs['name'] = kwargs.get('name', str(time.time()))
 
         # init the prepped values
-        pv = {}
+        pv = preparedValues()
+        pv['state'] = {} if state is None else state
 
-        # fix df
+        # fix df, the shallow copy shares the data with the dataframe passed in
         df = kwargs.get('df', None)
         if df is None:
             df = pd.DataFrame()
-        df = df.copy()
+        df = df.copy(deep=False)
 
         # setup X axis index in the dataframe
         if 'X' in df.columns:
             df = df.set_index('X')
         else:
-            df.index.name = 'X'
+            df.index = df.index.rename('X')
+        df.columns = df.columns.map(str)
         pv['df'] = df
 
-        # generate the palette
-        pv['palette'] = configure_color_palette(pv['df'], kwargs.get('user_palette', None))
-
-        # create the column data source for bokeh
-        pv['df'].columns = pv['df'].columns.map(str)
-        pv['cds'] = bokeh.models.ColumnDataSource(bokeh.models.ColumnDataSource.from_df(pv['df']))
-
         # save the target div
         pv['div_id'] = f"div_{kwargs['name']}"
 
-        # compute the figure_kwargs
-        figure_kwargs = cls._extract_targetclass_kwargs(bokeh.plotting.figure, kwargs, delete=True)
+        # compute the figure_kwargs, the names of the kwargs which are figure attributes are cached per chart
+        key = frozenset(kwargs.keys())
+        cached = pv['state'].get('figure_kwarg_names', None)
+        if (cached is not None) and (cached[0] == key):
+            figure_kwargs = {k: kwargs.pop(k) for k in cached[1]}
+        else:
+            figure_kwargs = cls._extract_targetclass_kwargs(bokeh.plotting.figure, kwargs, delete=True)
+            pv['state']['figure_kwarg_names'] = (key, list(figure_kwargs.keys()))
 #        figure_kwargs.update(promote_kwargs_prefix(['__figure__'], kwargs))
         if 'x_axis_type' in kwargs:
             figure_kwargs['x_axis_type'] = kwargs['x_axis_type']
@@ -327,48 +590,553 @@ class pluginBokeh:
         return pv
 
 
-    def add_custom_chart_type(self, chart_type, create_func, update_func):
+    def add_custom_chart_type(self, chart_type, create_func, update_func, stream_func=None, prepare_func=None):
         globals()[f'create_{chart_type}_chart_js'] = create_func
         globals()[f'update_{chart_type}_chart_js'] = update_func
+        if stream_func is not None:
+            globals()[f'stream_{chart_type}_chart_js'] = stream_func
+        if prepare_func is not None:
+            globals()[f'prepare_{chart_type}_chart_df'] = prepare_func
 
 
     def _create_chart(self, chart_type, page_instance_id, jsc_sequence_number=0, **kwargs):
+        # charts are created while the page is rendered on the IOLoop, remember it for coalesced updates
+        if self._scheduler is not None:
+            self._scheduler.set_io_loop(current_io_loop())
+
         # create the document if needed
-        if page_instance_id not in self.BOKEH_CONTEXT:
-            self.BOKEH_CONTEXT[page_instance_id] = {}
-            self.BOKEH_CONTEXT[page_instance_id]['kwargs'] = {}
+        page_context = self._get_page_context(page_instance_id, create=True)
 
-        # save the chart_type and kwargs
+        # save the chart_type and kwargs, the initial data is not kept since every update passes its own
         kwargs['chart_type'] = kwargs.get('chart_type', chart_type)
-        self.BOKEH_CONTEXT[page_instance_id]['kwargs'][kwargs['name']] = kwargs
-        pv = self._prep_for_chart(**kwargs)
+        df = kwargs.pop('df', None)
+        page_context['kwargs'][kwargs['name']] = kwargs
+
+        # start a fresh state for the chart, chart types use this to remember what the browser holds
+        page_context['state'][kwargs['name']] = {}
+
+        # convert data other than a dataframe, i.e. raw histogram samples, the same way update_chart does
+        func_df = globals().get(f'prepare_{kwargs["chart_type"]}_chart_df', None)
+        if (func_df is not None) and (df is not None):
+            df = func_df(df, page_context['state'][kwargs['name']], kwargs)
+        pv = self._prep_for_chart(df=df, state=page_context['state'][kwargs['name']], **kwargs)
+
+        # the chart will be in a new bokeh document
+        page_context['doc_index'].pop(kwargs['name'], None)
+
+        # load the extra BokehJS bundles this chart needs which the page has not loaded yet
+        bundles = list(self.CHART_TYPE_BUNDLES.get(chart_type, []))
+        if pv['figure_kwargs'].get('output_backend', None) == 'webgl':
+            bundles.append('bokeh-gl')
+        bundles.extend(kwargs.get('bokeh_bundles', []))
+        scripts = ''
+        for b in bundles:
+            if b not in page_context['bundles']:
+                page_context['bundles'].add(b)
+                scripts += self._bundle_script(b)
+
         try:
             func_js = globals()[f'create_{chart_type}_chart_js']
             div = f"<div id={pv['div_id']} style='margin:0 px; padding: 0px; width:100%; height:100%;'></div>"
             script = f"<script>{func_js(pv)}</script>"
-            return div + script
+            pv['state']['columns'] = list(pv['df'].columns)
+            return scripts + div + script
         except:
             return '<div>Unable to create chart</div>'
 
     @classmethod
-    def get_bokeh_chart(cls, jsc, chart_name) -> bokehChart:
-        return bokehChart(jsc, chart_name)
+    def get_bokeh_chart(cls, jsc, chart_name, deferred=False, **kwargs) -> bokehChart:
+        """ return an object to draw on a chart from python
+
+            The index of the chart in Bokeh.documents is looked up with a blocking round trip to the browser
+            the first time, and cached for the page until the chart is created again
+
+            Args:
+                jsc - pyLinkJS context
+                chart_name - name of the chart
+                deferred - if True, never block, the chart is looked up by the browser when the buffered
+                           commands run
+
+            Kwargs:
+                passed to bokehChart, i.e. flush_bytes and flush_ms
+
+            Returns:
+                bokehChart object for the chart
+        """
+        if deferred:
+            return bokehChart(jsc, chart_name, deferred=True, **kwargs)
+
+        page_context = cls._get_page_context(jsc.page_instance_id)
+        if page_context is None:
+            return bokehChart(jsc, chart_name, **kwargs)
+
+        chart = bokehChart(jsc, chart_name, doc_index=page_context['doc_index'].get(chart_name, None), **kwargs)
+        page_context['doc_index'][chart_name] = chart._doc_index
+        return chart
+
+    @classmethod
+    def _update_chart(cls, jsc, chart_name, df, **kwargs):
+        """ update a chart with new data
+
+            Args:
+                jsc - pyLinkJS context
+                chart_name - name of the chart
+                df - dataframe containing the new data for the chart
+
+            Kwargs:
+                keyword args which override the keyword args given at chart creation for this update only,
+                i.e. max_points=1000
+        """
+        cls._send_chart_updates(jsc, {chart_name: (df, kwargs)}, prepare=True)
+
+    @classmethod
+    def _update_charts(cls, jsc, dfs, **kwargs):
+        """ update several charts on the page with a single message to the browser
+
+            The browser applies all of the updates in the same animation frame
+
+            Args:
+                jsc - pyLinkJS context
+                dfs - dictionary of chart name to dataframe containing the new data for the chart
+
+            Kwargs:
+                keyword args which override the keyword args given at chart creation for this update only,
+                applied to every chart
+        """
+        cls._send_chart_updates(jsc, {chart_name: (df, kwargs) for chart_name, df in dfs.items()}, prepare=True)
+
+    def _update_chart_async(self, jsc, chart_name, df, **kwargs):
+        """ update a chart with new data, preparing the update on a worker thread
+
+            The data is prepared and the javascript generated on the worker threads, so the calling thread is
+            free to serve other pages.  Updates to the same chart are prepared one at a time, and an update
+            which is superseded by a newer update to the same chart before it starts is skipped, so a slow
+            update never overwrites a newer one.  The javascript is sent to the browser from the IOLoop of
+            the calling thread
+
+            Args:
+                jsc - pyLinkJS context
+                chart_name - name of the chart
+                df - dataframe containing the new data for the chart
+
+            Kwargs:
+                see _update_chart
+
+            Returns:
+                awaitable future if called with an asyncio loop running, otherwise a concurrent.futures.Future.
+                The result is True if the update was sent, or False if it was skipped
+        """
+        seq = self._next_async_seq(jsc, chart_name)
+        if seq is None:
+            logging.info(f'"{chart_name}" not found on page')
+            future = concurrent.futures.Future()
+            future.set_result(False)
+        else:
+            future = self._executor.submit(self._update_chart_job, jsc, chart_name, df, kwargs, seq,
+                                           current_io_loop())
+
+        try:
+            return asyncio.wrap_future(future, loop=asyncio.get_running_loop())
+        except RuntimeError:
+            return future
+
+    @classmethod
+    def _next_async_seq(cls, jsc, chart_name):
+        """ start a new update of a chart, superseding the updates from update_chart_async not yet started
+
+            Args:
+                jsc - pyLinkJS context
+                chart_name - name of the chart
+
+            Returns:
+                sequence number of the update, or None if the chart is not on the page
+        """
+        page_context = cls._get_page_context(jsc.page_instance_id)
+        if (page_context is None) or (chart_name not in page_context['kwargs']):
+            return None
+        order = cls._chart_order(page_context, chart_name)
+        with cls._BOKEH_CONTEXT_LOCK:
+            order['seq'] += 1
+            return order['seq']
 
     @classmethod
-    def _update_chart(cls, jsc, chart_name, df):
+    def _chart_order(cls, page_context, chart_name):
+        """ return the values which keep the updates of a chart in order
+
+            Every update, stream and update_chart_async of a chart generates and sends its javascript while
+            holding the lock of the chart, and sends it with _send_js, so the browser receives the updates in
+            the same order the state of the chart was changed in
+
+            Args:
+                page_context - context of the page, see _get_page_context
+                chart_name - name of the chart
+
+            Returns:
+                dictionary of
+                    'lock' - lock held while the javascript for the chart is generated and sent
+                    'seq' - sequence number of the latest update, see _next_async_seq
+                    'queued' - number of messages for the chart queued on the IOLoop and not yet sent
+                    'io_loop' - IOLoop the messages were queued on
+        """
+        with cls._BOKEH_CONTEXT_LOCK:
+            return page_context['order'].setdefault(chart_name, {'lock': threading.RLock(), 'seq': 0, 'queued': 0,
+                                                                 'io_loop': None})
+
+    @classmethod
+    def _send_js(cls, jsc, orders, js, io_loop=None):
+        """ send javascript to the browser behind the messages of the charts already queued on the IOLoop
+
+            Must be called while holding the lock of every chart the javascript updates
+
+            Args:
+                jsc - pyLinkJS context
+                orders - list of the values which keep the updates of each chart in order, see _chart_order
+                js - javascript to send
+                io_loop - IOLoop to send the javascript from, or None to send immediately if no messages of
+                          the charts are queued
+        """
+        with cls._BOKEH_CONTEXT_LOCK:
+            if io_loop is None:
+                io_loop = next((o['io_loop'] for o in orders if o['queued'] > 0), None)
+                if io_loop is None:
+                    jsc.eval_js_code(js, blocking=False)
+                    return
+            for o in orders:
+                o['queued'] += 1
+                o['io_loop'] = io_loop
+
+        def send():
+            try:
+                jsc.eval_js_code(js, blocking=False)
+            finally:
+                with cls._BOKEH_CONTEXT_LOCK:
+                    for o in orders:
+                        o['queued'] -= 1
+
+        # IOLoop callbacks run in the order they are added, so the messages reach the browser in order
+        io_loop.add_callback(send)
+
+    @classmethod
+    def _update_chart_job(cls, jsc, chart_name, df, kwargs, seq, io_loop):
+        """ prepare and send an update from update_chart_async, runs on a worker thread
+
+            Args:
+                jsc - pyLinkJS context
+                chart_name - name of the chart
+                df - dataframe containing the new data for the chart
+                kwargs - see _update_chart
+                seq - sequence number of the update, see _next_async_seq
+                io_loop - IOLoop to send the javascript from, or None to send from the worker thread
+
+            Returns:
+                True if the update was sent, False if it was skipped
+        """
+        page_context = cls._get_page_context(jsc.page_instance_id)
+        if (page_context is None) or (chart_name not in page_context['order']):
+            return False
+        order = page_context['order'][chart_name]
+
+        with order['lock']:
+            # data accumulated by the chart, i.e. histogram samples, is kept even if the update is skipped
+            df = cls._prepare_chart_df(jsc, chart_name, df, **kwargs)
+            if order['seq'] != seq:
+                return False
+
+            js = cls._update_chart_js(jsc, chart_name, df, **kwargs)
+            if js is None:
+                return False
+            cls._send_js(jsc, [order], js, io_loop)
+        return True
+
+    @classmethod
+    def _prepare_chart_df(cls, jsc, chart_name, df, **kwargs):
+        """ convert the data passed to update_chart into a dataframe for the chart
+
+            Chart types which accept data other than a dataframe provide a prepare_<chart_type>_chart_df
+            function, i.e. prepare_histogram_chart_df bins raw samples.  This runs when the update is
+            submitted, before updates are coalesced, so data accumulated by the chart is never dropped.  The
+            state of the chart is changed while holding the lock of the chart, see _chart_order
+
+            Args:
+                see _update_chart
+
+            Returns:
+                dataframe for the chart
+        """
+        page_context = cls._get_page_context(jsc.page_instance_id)
+        if (page_context is None) or (chart_name not in page_context['kwargs']):
+            return df
+        kwargs = {**page_context['kwargs'][chart_name], **kwargs}
+
+        func_df = globals().get(f'prepare_{kwargs["chart_type"]}_chart_df', None)
+        if func_df is None:
+            return df
+        with cls._chart_order(page_context, chart_name)['lock']:
+            return func_df(df, page_context['state'].setdefault(chart_name, {}), kwargs)
+
+    @classmethod
+    def _send_chart_updates(cls, jsc, updates, prepare=False):
+        """ send updates for one or more charts on the page in a single message
+
+            Args:
+                jsc - pyLinkJS context
+                updates - dictionary of chart name to (df, kwargs), see _update_chart
+                prepare - if True, convert the data with _prepare_chart_df while holding the locks of the
+                          charts, so the data is prepared and sent in the same order
+        """
+        page_context = cls._get_page_context(jsc.page_instance_id)
+        orders = []
+        if page_context is not None:
+            orders = [cls._chart_order(page_context, chart_name) for chart_name in sorted(updates.keys())
+                      if chart_name in page_context['kwargs']]
+
+        # the locks are always taken in the order of the chart names, so two batches can not deadlock
+        with contextlib.ExitStack() as stack:
+            for order in orders:
+                stack.enter_context(order['lock'])
+
+            js_list = []
+            for chart_name, (df, kwargs) in updates.items():
+                cls._next_async_seq(jsc, chart_name)
+                if prepare:
+                    df = cls._prepare_chart_df(jsc, chart_name, df, **kwargs)
+                js = cls._update_chart_js(jsc, chart_name, df, **kwargs)
+                if js is not None:
+                    js_list.append(js)
+
+            if len(js_list) == 0:
+                return
+            if len(js_list) == 1:
+                cls._send_js(jsc, orders, js_list[0])
+                return
+
+            # isolate the charts from each other so one failing chart does not stop the rest
+            js = '\n'.join([f"""try {{ {js} }} catch (e) {{ console.error(e); }} \n""" for js in js_list])
+            cls._send_js(jsc, orders, f"""requestAnimationFrame(function() {{ {js} }}); \n""")
+
+    @classmethod
+    def _update_chart_js(cls, jsc, chart_name, df, **kwargs):
+        """ create the javascript to update a chart with new data
+
+            Args:
+                see _update_chart
+
+            Returns:
+                javascript to update the chart, or None if the chart is not on the page
+        """
         # get the kwargs for the chart when itw as created
-        if chart_name not in cls.BOKEH_CONTEXT[jsc.page_instance_id]['kwargs']:
+        page_context = cls._get_page_context(jsc.page_instance_id)
+        if (page_context is None) or (chart_name not in page_context['kwargs']):
             logging.info(f'"{chart_name}" not found on page')
-            return
-        kwargs = cls.BOKEH_CONTEXT[jsc.page_instance_id]['kwargs'][chart_name]
+            return None
+        kwargs = {**page_context['kwargs'][chart_name], **kwargs}
+        stats = cls.BOKEH_STATS
+        if stats is not None:
+            t_start = time.perf_counter()
 
         # calcualte prepared values
-        pv = cls._prep_for_chart(df=df, **kwargs)
+        pv = cls._prep_for_chart(df=df, state=page_context['state'].setdefault(chart_name, {}), **kwargs)
+        if stats is not None:
+            t_prep = time.perf_counter()
 
         # call the update_js for the chart type, i.e. update_line_chart_js
         func_js = globals()[f'update_{kwargs["chart_type"]}_chart_js']
         js = func_js(pv)
 
-        js = js + cls.BOKEH_CONTEXT[jsc.page_instance_id]['kwargs'][chart_name].get('post_figure_update_js', '')
+        js = js + kwargs.get('post_figure_update_js', '')
+        if stats is not None:
+            t_end = time.perf_counter()
+            stats.record(kwargs['chart_type'], chart_name, t_prep - t_start, t_end - t_prep, len(js))
+            js = cls._latency_js(jsc, chart_name, js, t_end - t_start)
+
+        # remember the columns the browser now holds for the chart
+        pv['state']['columns'] = list(pv['df'].columns)
+
+        return js
+
+    @classmethod
+    def get_bokeh_stats(cls, jsc=None, fmt='dict'):
+        """ return the statistics collected on the updates of each chart
+
+            Statistics are only collected if the plugin was created with stats=True
+
+            Args:
+                jsc - pyLinkJS context, not used
+                fmt - 'dict' to return a dictionary, or 'openmetrics' to return text which Prometheus can scrape
+
+            Returns:
+                statistics, or None if statistics are not enabled
+                    'charts' - list of dictionaries with the counters for each chart type and chart name
+                        'chart_type', 'chart_name' - the chart
+                        'updates' - number of updates and streams sent
+                        'prep_seconds' - seconds spent in _prep_for_chart
+                        'js_seconds' - seconds spent generating the javascript
+                        'js_bytes' - bytes of javascript generated
+                    'latency' - list of dictionaries with the end to end latency of each chart type and chart name
+                        'chart_type', 'chart_name' - the chart
+                        'count', 'sum' - number of updates timed by the browser and their total seconds
+                        'p50', 'p99' - percentiles of the seconds from the start of the update in python until
+                                       the next animation frame in the browser, excluding the network
+                        'python_p50', 'parse_p50', 'build_p50', 'frame_p50' and the same for p99 - percentiles of
+                                       each part of the latency
+                    'contexts' - number of page contexts held
+                    'evictions' - number of page contexts evicted, see BOKEH_CONTEXT_EVICTIONS
+        """
+        stats = cls.BOKEH_STATS
+        if stats is None:
+            return None
+        latency = stats.latency()
+        with cls._BOKEH_CONTEXT_LOCK:
+            contexts = len(cls.BOKEH_CONTEXT)
+            evictions = dict(cls.BOKEH_CONTEXT_EVICTIONS)
+
+        if fmt == 'openmetrics':
+            gauges = {'contexts': ('number of page contexts held', contexts)}
+            for k, v in evictions.items():
+                gauges[f'context_evictions_{k}'] = (f'number of page contexts evicted by {k}', v)
+            return stats.openmetrics(gauges)
+        return {'charts': stats.snapshot(), 'latency': latency, 'contexts': contexts, 'evictions': evictions}
+
+    @classmethod
+    def _latency_js(cls, jsc, chart_name, js, python_seconds=0):
+        """ wrap the javascript of an update so the browser times it and reports the timing back
+
+            Args:
+                jsc - pyLinkJS context
+                chart_name - name of the chart
+                js - javascript of the update
+                python_seconds - seconds spent in python generating the javascript
+
+            Returns:
+                javascript of the update, unchanged if statistics are not enabled
+        """
+        stats = cls.BOKEH_STATS
+        if stats is None:
+            return js
+
+        page_context = cls._get_page_context(jsc.page_instance_id)
+        chart_type = 'unknown'
+        if (page_context is not None) and (chart_name in page_context['kwargs']):
+            chart_type = page_context['kwargs'][chart_name]['chart_type']
+
+        seq = stats.begin_update(jsc.page_instance_id, chart_type, chart_name, python_seconds)
+        return f""" if (window.bokeh_latency_begin) bokeh_latency_begin({seq});
+                   try {{
+                       {js}
+                   }} finally {{
+                       if (window.bokeh_latency_end) bokeh_latency_end();
+                   }} \n"""
+
+    @classmethod
+    def _bokeh_callback(cls, jsc, action, *args):
+        """ dispatch a callback from the browser, see bokeh_callback
+
+            Args:
+                jsc - pyLinkJS context
+                action - name of the action
+                args - arguments for the action
+        """
+        if action in ('table_page', 'table_sort', 'table_filter'):
+            if len(args) != 2:
+                logging.warning(f'Ignoring {action} with {len(args)} arguments, expected chart name and value')
+                return
+            cls._table_callback(jsc, action, *args)
+        elif action == 'latency':
+            if cls.BOKEH_STATS is not None:
+                cls.BOKEH_STATS.record_latency(jsc.page_instance_id, *args)
+        else:
+            logging.warning(f'Unknown bokeh callback action "{action}"')
+
+    @classmethod
+    def _table_callback(cls, jsc, action, chart_name, value):
+        """ change the page, sort or filter of a server side table
+
+            Args:
+                jsc - pyLinkJS context
+                action - 'table_page', 'table_sort' or 'table_filter'
+                chart_name - name of the table
+                value - value for the action, see table_callback_js
+        """
+        page_context = cls._get_page_context(jsc.page_instance_id)
+        if (page_context is None) or (chart_name not in page_context['kwargs']):
+            logging.info(f'"{chart_name}" not found on page')
+            return
+
+        # the view is changed and sent in order with the other updates of the table
+        order = cls._chart_order(page_context, chart_name)
+        with order['lock']:
+            # the full dataframe is already in the state, so prepare the values without any data
+            pv = cls._prep_for_chart(state=page_context['state'].setdefault(chart_name, {}),
+                                     **page_context['kwargs'][chart_name])
+            try:
+                js = table_callback_js(pv, action, value)
+            except ValueError as e:
+                logging.warning(f'Ignoring {action} of "{chart_name}": {e}')
+                return
+            cls._send_js(jsc, [order], js)
+
+    def _stream_chart_coalesced(self, jsc, chart_name, df, rollover=None):
+        """ append new rows to a chart whose updates are coalesced, see _stream_chart
+
+            The pending update of the chart is sent first, so it can not be sent after the new rows and wipe
+            them out
+        """
+        self._scheduler.send_now(jsc.page_instance_id, chart_name)
+        self._stream_chart(jsc, chart_name, df, rollover)
+
+    @classmethod
+    def _stream_chart(cls, jsc, chart_name, df, rollover=None):
+        """ append new rows to a chart without resending the rows already in the browser
+
+            Only chart types which provide a stream_<chart_type>_chart_js function can be streamed.  If the
+            chart type can not be streamed, or the columns of the new rows do not match the columns
+            already in the browser, the chart is fully updated with the new rows instead
+
+            Args:
+                jsc - pyLinkJS context
+                chart_name - name of the chart
+                df - dataframe containing only the new rows
+                rollover - maximum number of rows to keep in the browser, None keeps everything
+        """
+        # get the kwargs for the chart when it was created
+        page_context = cls._get_page_context(jsc.page_instance_id)
+        if (page_context is None) or (chart_name not in page_context['kwargs']):
+            logging.info(f'"{chart_name}" not found on page')
+            return
+        kwargs = page_context['kwargs'][chart_name]
+        state = page_context['state'].setdefault(chart_name, {})
+        order = cls._chart_order(page_context, chart_name)
+
+        # the rows are streamed onto the latest data, so updates from update_chart_async not yet started are
+        # superseded the same way a synchronous update supersedes them
+        with order['lock']:
+            cls._next_async_seq(jsc, chart_name)
+            stats = cls.BOKEH_STATS
+            if stats is not None:
+                t_start = time.perf_counter()
+
+            # calculate prepared values
+            pv = cls._prep_for_chart(df=df, state=state, **kwargs)
+            if stats is not None:
+                t_prep = time.perf_counter()
+
+            # fall back to a full update if streaming is not possible
+            func_js = globals().get(f'stream_{kwargs["chart_type"]}_chart_js', None)
+            if (func_js is None) or (state.get('columns') != list(pv['df'].columns)):
+                cls._update_chart(jsc, chart_name, df)
+                return
+
+            # call the stream_js for the chart type, i.e. stream_line_chart_js.  the chart types built in append
+            # the new rows to the data remembered for patching, see stream_figure
+            cds_df = state.get('cds_df', None)
+            js = func_js(pv, rollover)
+            if stats is not None:
+                t_end = time.perf_counter()
+                stats.record(kwargs['chart_type'], chart_name, t_prep - t_start, t_end - t_prep, len(js))
+                js = cls._latency_js(jsc, chart_name, js, t_end - t_start)
 
-        jsc.eval_js_code(js, blocking=False)
+            # if the chart type did not append the new rows, the browser data no longer matches the data
+            # remembered, so the next update can not be a patch
+            if (cds_df is not None) and (state.get('cds_df', None) is cds_df):
+                state.pop('cds_df', None)
+            cls._send_js(jsc, [order], js)
@@ -3,9 +3,10 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
+import json
+import numpy as np
 import pandas as pd
-import bokeh.models
-from .bokehPlugin_util import post_process_figure, reset_figure, configure_color_palette
+from .bokehPlugin_util import post_process_figure, reset_figure, configure_color_palette, update_figure_data
 
 
 # --------------------------------------------------
@@ -41,6 +42,49 @@ def create_chart_js(pv):
     return js
 
 
+def create_chart_boxes_df(pv, palette):
+    """ compute the statistics for every column and lay them out as the rows of a shared ColumnDataSource
+
+        Each column of the input dataframe is drawn as three rows of data.  The segment columns hold the
+        lower whisker, the upper whisker and the stem.  The quad columns hold the lower and upper half of
+        the box, the third row is hidden using quad_alpha.
+
+        Args:
+            pv - see create_chart_js documentation for pv documentation
+            palette - palette to draw the boxes with
+
+        Returns:
+            DataFrame with three rows per column of the input dataframe
+    """
+    df = pv['df']
+    values = df.to_numpy(dtype=float)
+    mean = np.nanmean(values, axis=0)
+    std = np.nanstd(values, axis=0, ddof=1)
+    p25, p75 = np.nanpercentile(values, [25, 75], axis=0)
+    upper = mean + std * 3
+    lower = mean - std * 3
+    if 'whisker_floor' in pv['kwargs']:
+        lower = np.maximum(pv['kwargs']['whisker_floor'], lower)
+
+    # x position of the center of each box on the categorical axis
+    x = np.arange(len(df.columns)) + 0.5
+
+    def rows(a, b, c):
+        return np.stack([a, b, c], axis=1).ravel()
+
+    return pd.DataFrame({
+        'x0': rows(x - 0.1, x - 0.1, x),
+        'x1': rows(x + 0.1, x + 0.1, x),
+        'y0': rows(lower, upper, upper),
+        'y1': rows(lower, upper, lower),
+        'left': rows(x - 0.2, x - 0.2, x - 0.2),
+        'right': rows(x + 0.2, x + 0.2, x + 0.2),
+        'bottom': rows(p25, mean, mean),
+        'top': rows(mean, p75, mean),
+        'fill_color': np.tile(np.asarray([palette[1], palette[2], palette[1]], dtype=object), len(df.columns)),
+        'quad_alpha': np.tile([1.0, 1.0, 0.0], len(df.columns))})
+
+
 def update_chart_js(pv):
     """ update the chart with new data
 
@@ -57,40 +101,34 @@ def update_chart_js(pv):
         kwargs['user_palette'] = pv['kwargs'] ['user_palette']
     palette = configure_color_palette(pd.DataFrame(index=[0], columns=['A', 'B', 'C']), **kwargs)
 
-    df = pv['df']
-
-    if df.empty:
+    if pv['df'].empty:
         return ''
 
-
-    d = {
-        'factors': list(df.columns),
-        'mean': df.mean().values,
-        'upper': (df.mean() + df.std() * 3).values,
-        'lower': (df.mean() - df.std() * 3).values,
-        '25percentile': df.describe().loc['25%'].values,
-        '75percentile': df.describe().loc['75%'].values
-    }
-    cds = bokeh.models.ColumnDataSource(d)
-    df = cds.to_df()
-
-    js = reset_figure(df, pv['figure_kwargs']['name'], no_legend=True)
-
-    # rebuilt the y_range factors
-    factors_str = d['factors']
-    js += f"""f.x_range.factors = {factors_str};"""
-
-    i = 0
-    for _, r in df.iterrows():
-        # calculate whisker lower
-        wl = max(pv['kwargs'].get('whisker_floor', r.lower), r.lower)
-
-        js += f"""
-            f.line({{x: [{0.5 + i - 0.1}, {0.5 + i + 0.1}], y: [{wl}, {wl}], line_color: '{palette[0]}' }});
-            f.line({{x: [{0.5 + i - 0.1}, {0.5 + i + 0.1}], y: [{r.upper}, {r.upper}], line_color: '{palette[0]}' }});
-            f.line({{x: [{0.5 + i}, {0.5 + i}], y: [{r.upper}, {wl}], line_color: '{palette[0]}' }});
-            f.quad({{ left: {0.5 + i - 0.2}, right: {0.5 + i + 0.2}, top: {r["mean"]}, bottom: {r["25percentile"]}, fill_color: '{palette[1]}' }});
-            f.quad({{ left: {0.5 + i - 0.2}, right: {0.5 + i + 0.2}, top: {r["75percentile"]}, bottom: {r["mean"]}, fill_color: '{palette[2]}' }});
-        """
-        i = i + 1
+    df = create_chart_boxes_df(pv, palette)
+
+    # update the data in place if the glyphs on the figure can be reused
+    data_js = update_figure_data(df, pv['figure_kwargs']['name'], pv['state'],
+                                 transport=pv['kwargs'].get('transport', 'json'))
+    if data_js is None:
+        js = reset_figure(pv['state']['cds_df'], pv['figure_kwargs']['name'], no_legend=True, reset_index=False,
+                          transport=pv['kwargs'].get('transport', 'json'))
+    else:
+        js = data_js
+
+    # rebuilt the x_range factors if they changed
+    factors = [str(c) for c in pv['df'].columns]
+    if (data_js is None) or (pv['state'].get('factors') != factors):
+        js += f"""f.x_range.factors = {json.dumps(factors)};"""
+    pv['state']['factors'] = factors
+    if data_js is not None:
+        return js
+
+    js += f"""
+        // add the whiskers and the boxes
+        f.segment({{source: cds, x0: {{field: 'x0'}}, x1: {{field: 'x1'}}, y0: {{field: 'y0'}}, y1: {{field: 'y1'}},
+                   line_color: '{palette[0]}' }});
+        f.quad({{source: cds, left: {{field: 'left'}}, right: {{field: 'right'}}, top: {{field: 'top'}},
+                bottom: {{field: 'bottom'}}, fill_color: {{field: 'fill_color'}},
+                fill_alpha: {{field: 'quad_alpha'}}, line_alpha: {{field: 'quad_alpha'}} }});
+    """
     return js
@@ -3,8 +3,11 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
+import collections
+import logging
+import numpy as np
 import pandas as pd
-from .bokehPlugin_util import promote_kwargs_prefix, configure_color_palette, post_process_figure, reset_figure
+from .bokehPlugin_util import promote_kwargs_prefix, configure_color_palette, post_process_figure, reset_figure, update_figure_data
 
 
 # --------------------------------------------------
@@ -40,9 +43,7 @@ def create_chart_df(pv):
     palette = configure_color_palette(pd.DataFrame(index=[0], columns=['A']), user_palette=pv['kwargs'].get('user_palette', None))
 
     # convert
-    df = pv['df'].copy()
-    df.index.name = 'factors'
-    df = df.reset_index()
+    df = pv['df'].rename_axis('factors').reset_index()
     df['fill_color'] = palette[0]
     df['line_color'] = palette[0]
     if not df.empty:
@@ -52,6 +53,97 @@ def create_chart_df(pv):
     return df.reset_index()
 
 
+def create_bin_labels(edges):
+    """ create a label for each bin from the edges of the bins, i.e. '-1 to -0.5'
+
+        The edges are written with one more decimal than the narrowest bin needs, so bins which are narrow
+        compared to their distance from 0 still get different labels.  Repeated empty bins, i.e. edges
+        [0, 1, 1, 1, 2], are numbered so every label is unique
+
+        Args:
+            edges - edges of the bins, increasing monotonically
+
+        Returns:
+            list of labels, one per bin
+    """
+    widths = np.diff(edges)
+    if (widths < 0).any():
+        raise ValueError('the edges of the bins must increase monotonically')
+    widths = widths[widths > 0]
+    width = widths.min() if len(widths) > 0 else 1
+    precision = max(0, -int(np.floor(np.log10(width)))) + 1
+    text = [np.format_float_positional(e, precision=precision, trim='-') for e in edges]
+    labels = [f'{a} to {b}' for a, b in zip(text[:-1], text[1:])]
+
+    # number the labels of repeated empty bins
+    seen = collections.Counter()
+    for i, label in enumerate(labels):
+        seen[label] += 1
+        if seen[label] > 1:
+            labels[i] = f'{label} ({seen[label]})'
+    return labels
+
+
+def prepare_chart_df(data, state, kwargs):
+    """ bin raw samples into the dataframe of counts expected by update_chart_js
+
+        Dataframes are passed through unchanged.  Any other data, i.e. a Series or ndarray, is treated as raw
+        samples and binned on the server.  The bin edges are cached in the chart state and are reused while
+        they do not depend on the samples, which is when range is given with a number of bins or when the
+        bins are the edges.  With accumulate the counts of the new samples are added to the counts already
+        on the chart, so the full history of samples never has to be binned again.  If the edges were
+        calculated from the first samples, later samples outside of them are dropped with a warning
+
+        Args:
+            data - dataframe of counts, or raw samples to bin
+            state - dictionary of state kept for the chart between updates
+            kwargs - keyword args of the chart
+                        'bins' - number of bins, edges of the bins or a binning method, see np.histogram
+                        'range' - lower and upper edge of the bins, samples outside the range are ignored
+                        'accumulate' - if True, add the counts of the samples to the counts on the chart
+
+        Returns:
+            dataframe with a counts and bin_text column, the index is the label of each bin
+    """
+    if (data is None) or isinstance(data, pd.DataFrame):
+        return data
+
+    values = np.asarray(data, dtype=float).ravel()
+    values = values[np.isfinite(values)]
+    bins = kwargs.get('bins', 10)
+    hist_range = kwargs.get('range', None)
+    key = (bins if np.isscalar(bins) else tuple(bins), None if hist_range is None else tuple(hist_range))
+
+    # calculate new edges unless the cached edges can be reused
+    fixed = (not np.isscalar(bins)) or (isinstance(bins, (int, np.integer)) and (hist_range is not None))
+    reuse = ('hist_edges' in state) and (state.get('hist_key') == key) and (fixed or kwargs.get('accumulate', False))
+    if not reuse:
+        edges = np.histogram_bin_edges(values, bins=bins, range=hist_range)
+        state['hist_key'] = key
+        state['hist_edges'] = edges
+        state['hist_labels'] = create_bin_labels(edges)
+        state['hist_counts'] = np.zeros(len(edges) - 1, dtype=np.int64)
+    edges = state['hist_edges']
+
+    # samples outside of a range the user did not ask for are dropped, so say so
+    if reuse and (not fixed) and (hist_range is None):
+        outside = np.count_nonzero((values < edges[0]) | (values > edges[-1]))
+        if outside > 0:
+            logging.warning(f'{outside} samples outside of the bins {edges[0]:g} to {edges[-1]:g} were dropped, '
+                            f'pass range or the edges as bins when accumulating')
+
+    # evenly spaced edges are binned without searching the edges
+    if np.isscalar(bins):
+        counts, _ = np.histogram(values, bins=len(edges) - 1, range=(edges[0], edges[-1]))
+    else:
+        counts, _ = np.histogram(values, bins=edges)
+    if reuse and kwargs.get('accumulate', False):
+        counts = counts + state['hist_counts']
+    state['hist_counts'] = counts
+
+    return pd.DataFrame({'counts': counts, 'bin_text': counts.astype(str)}, index=state['hist_labels'])
+
+
 def create_chart_js(pv):
     """ Create the javascript to create a chart
     
@@ -91,24 +183,36 @@ def update_chart_js(pv):
             javascript to update the chart with new data
     """
     df = create_chart_df(pv)
-    
-    js = reset_figure(df, pv['figure_kwargs']['name'])
+
+    # update the data in place if the bars and labels on the figure can be reused
+    data_js = update_figure_data(df, pv['figure_kwargs']['name'], pv['state'],
+                                  transport=pv['kwargs'].get('transport', 'json'))
+    if data_js is None:
+        js = reset_figure(pv['state']['cds_df'], pv['figure_kwargs']['name'], reset_index=False,
+                          transport=pv['kwargs'].get('transport', 'json'))
+    else:
+        js = data_js
 
     js += f"""
         f.x_range.factors = {list(df['factors'])};
         f.x_range.range_padding = 0.05;
-        
-        if (f.tags.length > 0) {{
-            f.remove_layout(f.tags[0]);
-            f.tags.pop();
-        }}        
     """
-    
+
     if not df.empty:
         js += f"""
         f.y_range = new Bokeh.Range1d({{start:0, end: {int(df['counts'].max() * 1.1)} }});
         """
 
+    if data_js is not None:
+        return js
+
+    js += """
+        if (f.tags.length > 0) {
+            f.remove_layout(f.tags[0]);
+            f.tags.pop();
+        }
+    """
+
     kwd = {}
     kwd['source'] = 'cds'
     kwd['x'] = "{field: 'factors'}"
@@ -3,7 +3,10 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
-from .bokehPlugin_util import post_process_figure, promote_kwargs_prefix, reset_figure
+import json
+import pandas as pd
+from .bokehPlugin_util import downsample_min_max, find_figure_js, post_process_figure, promote_kwargs_prefix, reset_figure, \
+    stream_figure, update_figure_data
 
 
 # --------------------------------------------------
@@ -55,12 +58,29 @@ def update_chart_js(pv):
 
         Args:
             pv - see create_chart_js documentation for pv documentation
+                    'kwargs'
+                        'max_points' - if set, the lines are downsampled to about this many points in total
+                                       before being sent to the browser, keeping the min and max of each line
+                        'mode' - 'line' to draw a line glyph per column, or 'multi_line' to draw all of
+                                 the columns with one multi_line glyph, see update_multi_line_chart_js
 
         Returns:
             javascript to update the chart with new data
     """    
+    # downsample long lines
+    df = downsample_min_max(pv['df'], pv['kwargs'].get('max_points', None))
+    if pv['kwargs'].get('mode', 'line') == 'multi_line':
+        return update_multi_line_chart_js(pv, df)
+
+    # update the data in place if the lines on the figure can be reused
+    js = update_figure_data(df, pv['figure_kwargs']['name'], pv['state'],
+                            transport=pv['kwargs'].get('transport', 'json'))
+    if js is not None:
+        return js
+
     # reset the figure
-    js = reset_figure(pv['df'], pv['figure_kwargs']['name'])
+    js = reset_figure(pv['state']['cds_df'], pv['figure_kwargs']['name'], reset_index=False,
+                      transport=pv['kwargs'].get('transport', 'json'))
 
     # add the new glyphs
     for i, c in enumerate(pv['df'].columns):
@@ -83,3 +103,146 @@ def update_chart_js(pv):
             f.legend.change.emit();
         """
     return js
+
+
+def create_multi_line_df(df, palette):
+    """ rearrange the dataframe so there is one row per line, as expected by the multi_line glyph
+
+        Args:
+            df - dataframe passed in by user, see update_chart_js
+            palette - color palette, one color per column
+
+        Returns:
+            dataframe with one row per column of the input dataframe
+
+                           xs            ys    color label
+                0   [0, 1, 2]  [58, 51, 5]  #1f77b4     A
+                1   [0, 1, 2]  [5, 85, 70]  #ff7f0e     B
+                2   [0, 1, 2]  [51, 83, 95] #2ca02c     C
+    """
+    x = df.index.to_numpy().tolist()
+    return pd.DataFrame({'xs': [x] * len(df.columns),
+                         'ys': df.to_numpy().T.tolist(),
+                         'color': list(palette[:len(df.columns)]),
+                         'label': [str(c) for c in df.columns]})
+
+
+def update_multi_line_chart_js(pv, df):
+    """ update a chart which draws all of the lines with one multi_line glyph
+
+        A figure with hundreds of line glyphs is slow to draw, a single multi_line glyph is not.  The legend
+        has one item per line up to legend_max_items, lines past the limit are not shown in the legend.
+
+        Args:
+            pv - see create_chart_js documentation for pv documentation
+                    'kwargs'
+                        'legend_max_items' - maximum number of lines shown in the legend, default is 20
+                        'hover_tooltip' - if True, show the name of the line under the mouse in a tooltip
+            df - dataframe to draw, see update_chart_js
+
+        Returns:
+            javascript to update the chart with new data
+    """
+    data = create_multi_line_df(df, pv['palette'])
+
+    # the legend and hover tool must be rebuilt if the lines changed
+    if pv['state'].get('series') != list(data['label']):
+        pv['state'].pop('cds_df', None)
+    pv['state']['series'] = list(data['label'])
+
+    # update the data in place if the lines on the figure can be reused
+    js = update_figure_data(data, pv['figure_kwargs']['name'], pv['state'],
+                            transport=pv['kwargs'].get('transport', 'json'))
+    if js is not None:
+        return js
+
+    # reset the figure
+    js = reset_figure(pv['state']['cds_df'], pv['figure_kwargs']['name'], reset_index=False,
+                      transport=pv['kwargs'].get('transport', 'json'))
+
+    # add one glyph for all of the lines
+    kwd = {}
+    kwd['source'] = 'cds'
+    kwd['xs'] = "{field: 'xs'}"
+    kwd['ys'] = "{field: 'ys'}"
+    kwd['color'] = "{field: 'color'}"
+    kwd.update(promote_kwargs_prefix(['__line__'], pv['kwargs']))
+    kwds = ', '.join([f"'{k}': {v}" for k, v in kwd.items()])
+    js += f"""
+        // add the lines
+        var mlo = f.multi_line({{ {kwds} }});
+
+        // add the legend items, the index picks the line from the data source
+        var items = [];
+        for (let i = 0; i < Math.min(cds.data.label.length, {int(pv['kwargs'].get('legend_max_items', 20))}); i++) {{
+            items.push(new Bokeh.LegendItem({{label: cds.data.label[i], renderers: [mlo], index: i}}));
+        }}
+        f.legend.items = items;
+    """
+
+    if pv['kwargs'].get('hover_tooltip', False):
+        js += """
+        // replace the hover tool
+        f.toolbar.tools = f.toolbar.tools.filter((t) => t.name != 'multi_line_hover');
+        f.add_tools(new Bokeh.HoverTool({name: 'multi_line_hover', renderers: [mlo], line_policy: 'nearest',
+                                         tooltips: [['line', '@label'], ['x', '$x'], ['y', '$y']]}));
+        """
+    return js
+
+
+def stream_multi_line_chart_js(pv, rollover=None):
+    """ append new rows to the lines of a chart drawn with one multi_line glyph
+
+        Args:
+            pv - see create_chart_js documentation for pv documentation, 'df' contains only the new rows
+            rollover - maximum number of points to keep in each line in the browser, None keeps everything
+
+        Returns:
+            javascript to stream the new rows into the chart
+    """
+    df = pv['df']
+
+    # append the new points to the lines remembered by update_figure_data, so the next update can be a patch
+    data = pv['state'].get('cds_df', None)
+    if (data is not None) and (len(data) == len(df.columns)):
+        new_xs = df.index.to_numpy().tolist()
+        start = 0 if rollover is None else -int(rollover)
+        data = data.copy()
+        data['xs'] = [(list(xs) + new_xs)[start:] for xs in data['xs']]
+        data['ys'] = [(list(ys) + new_ys)[start:] for ys, new_ys in zip(data['ys'], df.to_numpy().T.tolist())]
+        pv['state']['cds_df'] = data
+    else:
+        pv['state'].pop('cds_df', None)
+
+    js = find_figure_js(pv['figure_kwargs']['name'])
+    js += f""" var new_xs = JSON.parse('{json.dumps(df.index.to_numpy().tolist())}');
+              var new_ys = JSON.parse('{json.dumps(df.to_numpy().T.tolist())}');
+              var rollover = {'null' if rollover is None else int(rollover)};
+              var source = f.renderers.length > 0 ? f.renderers[0].data_source : null;
+              if (source != null) {{
+                  var data = Object.assign({{}}, source.data);
+                  data.xs = data.xs.map((xs) => Array.from(xs).concat(new_xs));
+                  data.ys = data.ys.map((ys, i) => Array.from(ys).concat(new_ys[i]));
+                  if (rollover != null) {{
+                      data.xs = data.xs.map((xs) => xs.slice(-rollover));
+                      data.ys = data.ys.map((ys) => ys.slice(-rollover));
+                  }}
+                  source.data = data;
+              }} \n"""
+    return js
+
+
+def stream_chart_js(pv, rollover=None):
+    """ append new rows to the lines already on the chart
+
+        Args:
+            pv - see create_chart_js documentation for pv documentation, 'df' contains only the new rows
+            rollover - maximum number of rows to keep in the browser, None keeps everything
+
+        Returns:
+            javascript to stream the new rows into the chart
+    """
+    if pv['kwargs'].get('mode', 'line') == 'multi_line':
+        return stream_multi_line_chart_js(pv, rollover)
+    return stream_figure(pv['df'], pv['figure_kwargs']['name'], rollover, transport=pv['kwargs'].get('transport', 'json'),
+                         state=pv['state'])
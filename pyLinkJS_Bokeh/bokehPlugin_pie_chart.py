@@ -3,8 +3,12 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
+import logging
 import math
-from .bokehPlugin_util import promote_kwargs_prefix, post_process_figure, reset_figure
+import re
+import bokeh.models
+import numpy as np
+from .bokehPlugin_util import promote_kwargs_prefix, post_process_figure, reset_figure, update_figure_data
 
 
 # --------------------------------------------------
@@ -56,10 +60,72 @@ def create_chart_df(pv):
     df['end_angle'] = df['angle'].cumsum()
     df['start_angle'] = df['end_angle'].shift(1).fillna(0)
     df['text_angle'] = (df['start_angle'] + df['end_angle']) / 2
+    df['text'] = df['text'].astype(str)
+    df.index = df.index.map(str)
     df.index.name = 'legend'
     return df
 
 
+def apply_wedge_overrides(df, kwd, kwargs):
+    """ move the keyword args for a single wedge, prefaced with __wedge_<i>__, into columns of the dataframe
+        so all the wedges can still be drawn as one glyph
+
+        Args:
+            df - dataframe from create_chart_df, changed in place
+            kwd - keyword args for all the wedges
+            kwargs - keyword arguments passed in during initial chart creation
+
+        Returns:
+            dictionary of wedge keyword args which read the overridden properties from the dataframe
+    """
+    # find the properties overridden for each wedge
+    overrides = {}
+    for k, v in kwargs.items():
+        m = re.match(r'__wedge_(\d+)__(.+)', k)
+        if m is None:
+            continue
+        i, prop = int(m.group(1)), m.group(2)
+        if (prop != 'color') and (prop not in bokeh.models.Wedge.dataspecs()):
+            logging.warning(f'Ignoring {k}, only data properties of the wedge can be set for a single wedge')
+            continue
+        value = _js_literal_value(v)
+        if value is None:
+            logging.warning(f'Ignoring {k}, the value must be a number or a quoted string')
+            continue
+        overrides.setdefault(prop, {})[i] = value
+
+    fields = {}
+    for prop, values in overrides.items():
+        # the default for wedges without an override is the value for all the wedges
+        column = 'color' if prop == 'color' else f'__wedge_{prop}'
+        default = _js_literal_value(kwd[prop]) if prop in kwd else None
+        if default is not None:
+            df[column] = [default] * len(df)
+        elif column not in df.columns:
+            df[column] = [getattr(bokeh.models.Wedge(), prop)] * len(df)
+        df[column] = df[column].astype(object)
+        for i, value in values.items():
+            if i < len(df):
+                df.iloc[i, df.columns.get_loc(column)] = value
+        fields[prop] = f"{{field: '{column}'}}"
+    return fields
+
+
+def _js_literal_value(v):
+    """ convert a javascript literal passed in as a keyword arg to a python value, None if it is not a simple literal """
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return v
+    if isinstance(v, str):
+        v = v.strip()
+        if (len(v) >= 2) and (v[0] == v[-1]) and (v[0] in '\'"'):
+            return v[1:-1]
+        try:
+            return float(v)
+        except ValueError:
+            return None
+    return None
+
+
 def create_chart_js(pv):
     """ Create the javascript to create a chart
     
@@ -73,6 +139,7 @@ def create_chart_js(pv):
                         (see bokeh Figure documentation for full list)
                     'kwargs' - keyword arguments passed in during initial chart creation
                         (keyword args prefaced with __wedge__ will be passed in for wedge creation.
+                         keyword args prefaced with __wedge_<i>__ only apply to the i-th wedge.
                          see Bokeh wedge documentation for full list of available keywords)
                     'palette' - color palette to use for chart rendering
 
@@ -108,48 +175,61 @@ def update_chart_js(pv):
     # convert the prepared values into a dataframe
     df = create_chart_df(pv)
 
-    # reset the figure
-    js = reset_figure(df, pv['figure_kwargs']['name'])
-
-    # add pie wedges
-    for i, c in enumerate(df.index):
-        kwd = {}
-        kwd['source'] = 'cds'
-        kwd['x'] = 0
-        kwd['y'] = 0
-        kwd['radius'] = 0.5
-        kwd['radius_units'] = "'data'"
-        # colors must be quoted string
-        kwd['color'] = f"'{pv['palette'][i]}'"
-        kwd['start_angle'] = df.iloc[i]['start_angle']
-        kwd['end_angle'] = df.iloc[i]['end_angle']
-        kwd['start_angle_units'] = "'rad'"
-        kwd['end_angle_units'] = "'rad'"
-        kwd.update(promote_kwargs_prefix(['__wedge__', f'__wedge_{i}__'], pv['kwargs']))
-        kwds = ', '.join([f"'{k}': {v}" for k, v in kwd.items()])
-
-        js += f""" // add the wedge    
-                   var wo = f.wedge({{ {kwds} }});
-            
-                   // add the legend item
-                   var lio = new Bokeh.LegendItem({{label: '{c}'}});
-                   lio.renderers.push(wo);
-                   f.legend.items.push(lio);
-                   f.legend.change.emit(); \n"""
-
-    # add pie wedges    
-    for i, c in enumerate(df.index):
-        kwd = {}
-        kwd['x'] = 0
-        kwd['y'] = 0
-        kwd['radius'] = 0.5
-        kwd['radius_units'] = "'data'"
-        kwd.update(promote_kwargs_prefix(['__wedge__', f'__wedge_{i}__'], pv['kwargs']))
-                
-        js += f""" // add the text
-                   var ar =  (f.inner_height / f.inner_width);   
-                   var tx = {kwd['x'] + kwd['radius'] * math.cos(df.iloc[i]['text_angle']) * 0.5};
-                   var ty = {kwd['y'] + kwd['radius'] * math.sin(df.iloc[i]['text_angle']) * 0.5} / ar;
-                   f.text({{x: tx, y: ty, text: '{df.iloc[i]['text']}', text_align: 'center', text_baseline: 'middle', color: 'white'}}); \n"""
+    # position of the pie and the text in the middle of each wedge
+    kwd = {}
+    kwd['x'] = 0
+    kwd['y'] = 0
+    kwd['radius'] = 0.5
+    kwd['radius_units'] = "'data'"
+    kwd.update(promote_kwargs_prefix(['__wedge__'], pv['kwargs']))
+    fields = {}
+    if not df.empty:
+        fields = apply_wedge_overrides(df, kwd, pv['kwargs'])
+        x, y, radius = [df[f'__wedge_{k}'].to_numpy(dtype=float) if f'__wedge_{k}' in df.columns else kwd[k]
+                        for k in ('x', 'y', 'radius')]
+        df['text_x'] = x + radius * np.cos(df['text_angle'].to_numpy(dtype=float)) * 0.5
+        df['text_y'] = y + radius * np.sin(df['text_angle'].to_numpy(dtype=float)) * 0.5
+
+    # update the data in place if the wedges and labels on the figure can be reused
+    data_js = update_figure_data(df, pv['figure_kwargs']['name'], pv['state'],
+                                 transport=pv['kwargs'].get('transport', 'json'))
+    if data_js is not None:
+        return data_js
+    js = reset_figure(pv['state']['cds_df'], pv['figure_kwargs']['name'], reset_index=False,
+                      transport=pv['kwargs'].get('transport', 'json'))
+    js += """
+        if (f.tags.length > 0) {
+            f.remove_layout(f.tags[0]);
+            f.tags.pop();
+        }
+    """
+    if df.empty:
+        return js
+
+    # add all the pie wedges as one glyph, the legend has one entry per wedge
+    kwd['source'] = 'cds'
+    kwd['color'] = "{field: 'color'}"
+    kwd['start_angle'] = "{field: 'start_angle'}"
+    kwd['end_angle'] = "{field: 'end_angle'}"
+    kwd['start_angle_units'] = "'rad'"
+    kwd['end_angle_units'] = "'rad'"
+    kwd['legend_field'] = "'legend'"
+    kwd.update(promote_kwargs_prefix(['__wedge__'], pv['kwargs']))
+    kwd.update(fields)
+    kwds = ', '.join([f"'{k}': {v}" for k, v in kwd.items()])
+
+    # add the text, the y position is corrected for the aspect ratio of the figure when drawn
+    js += f""" // add the wedges
+               var wo = f.wedge({{ {kwds} }});
+
+               // add the text
+               var ary = new Bokeh.CustomJSTransform({{args: {{f: f}},
+                   func: 'return x / ((f.inner_height / f.inner_width) || 1);',
+                   v_func: 'const ar = (f.inner_height / f.inner_width) || 1; return xs.map((x) => x / ar);'}});
+               var lso = new Bokeh.LabelSet({{source: cds, x: {{field: 'text_x'}}, y: {{field: 'text_y', transform: ary}},
+                                             text: {{field: 'text'}}, text_align: 'center', text_baseline: 'middle',
+                                             text_color: 'white', level: 'glyph'}});
+               f.add_layout(lso);
+               f.tags.push(lso); \n"""
 
     return js
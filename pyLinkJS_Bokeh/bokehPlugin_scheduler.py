@@ -0,0 +1,190 @@
+""" scheduler to coalesce chart updates for the Bokeh PyLinkJS plugin """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+import tornado.ioloop
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def current_io_loop():
+    """ return the Tornado IOLoop running on the current thread, or None if no loop is running """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    return tornado.ioloop.IOLoop.current()
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class updateScheduler:
+    """ coalesce chart updates so each chart is sent to the browser at most max_update_hz times per second
+
+        Updates are kept per page and chart.  If a newer update for the same chart arrives before the
+        pending one was sent, the pending one is dropped and only the latest is sent on the next tick of
+        the Tornado IOLoop.
+    """
+    def __init__(self, send_func, max_update_hz, io_loop=None, prepare_func=None):
+        """ init
+
+            Args:
+                send_func - function to send a batch of updates for one page, called as
+                            send_func(jsc, updates) where updates is a dictionary of chart name to (df, kwargs)
+                max_update_hz - maximum number of updates per second sent for each chart
+                io_loop - Tornado IOLoop to flush updates on, default is the IOLoop of the first thread
+                          which submits an update or calls set_io_loop
+                prepare_func - if set, called as prepare_func(jsc, chart_name, df, **kwargs) when an update is
+                               submitted and returns the dataframe to queue in place of df.  Updates to the same
+                               chart are prepared and queued one at a time, in the order they are prepared
+        """
+        self._send_func = send_func
+        self._prepare_func = prepare_func
+        self._interval = 1.0 / max_update_hz
+        self._io_loop = io_loop
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._chart_locks = {}
+        self._scheduled = set()
+        self._last_sent = {}
+        self.dropped_count = 0
+
+    def set_io_loop(self, io_loop):
+        """ set the IOLoop to flush updates on if it has not been set yet """
+        if self._io_loop is None:
+            self._io_loop = io_loop
+
+    def submit(self, jsc, chart_name, df, **kwargs):
+        """ queue an update for a chart, replacing any pending update for the same chart
+
+            Args:
+                jsc - pyLinkJS context
+                chart_name - name of the chart
+                df - dataframe containing the new data for the chart
+
+            Kwargs:
+                passed through to send_func
+        """
+        self.submit_many(jsc, {chart_name: df}, **kwargs)
+
+    def submit_many(self, jsc, dfs, **kwargs):
+        """ queue updates for several charts on the same page, replacing any pending updates for those charts
+
+            Args:
+                jsc - pyLinkJS context
+                dfs - dictionary of chart name to dataframe containing the new data for the chart
+
+            Kwargs:
+                passed through to send_func for every chart
+        """
+        self.set_io_loop(current_io_loop())
+
+        # the chart locks are held from preparing the data until it is queued, so an update prepared later
+        # never queues older data.  they are always taken in the order of the chart names to avoid deadlocks
+        schedule = []
+        with contextlib.ExitStack() as stack:
+            for chart_name in sorted(dfs.keys()):
+                stack.enter_context(self._chart_lock((jsc.page_instance_id, chart_name)))
+
+            if self._prepare_func is not None:
+                dfs = {chart_name: self._prepare_func(jsc, chart_name, df, **kwargs) for chart_name, df in dfs.items()}
+
+            if self._io_loop is None:
+                # no IOLoop to flush on, send immediately
+                self._send_func(jsc, {chart_name: (df, kwargs) for chart_name, df in dfs.items()})
+                return
+
+            with self._lock:
+                for chart_name, df in dfs.items():
+                    key = (jsc.page_instance_id, chart_name)
+                    if key in self._pending:
+                        self.dropped_count = self.dropped_count + 1
+                    self._pending[key] = (jsc, df, kwargs)
+                    if key not in self._scheduled:
+                        self._scheduled.add(key)
+                        schedule.append((self._delay(key), key))
+
+        # call_later is not thread safe, so hop onto the IOLoop first
+        for delay, key in schedule:
+            self._io_loop.add_callback(self._io_loop.call_later, delay, self._flush, key)
+
+    def _chart_lock(self, key):
+        """ return the lock held while an update for a chart is prepared and queued
+
+            Args:
+                key - (page_instance_id, chart_name) of the chart
+        """
+        with self._lock:
+            return self._chart_locks.setdefault(key, threading.Lock())
+
+    def send_now(self, page_instance_id, chart_name):
+        """ send the pending update for a chart immediately, i.e. before new rows are streamed onto the chart
+
+            Args:
+                page_instance_id - id of the page
+                chart_name - name of the chart
+        """
+        key = (page_instance_id, chart_name)
+        with self._lock:
+            pending = self._pending.pop(key, None)
+            if pending is None:
+                return
+            self._last_sent[key] = time.monotonic()
+
+        # the flush still scheduled for the chart will find nothing pending
+        jsc, df, kwargs = pending
+        self._send_func(jsc, {chart_name: (df, kwargs)})
+
+    def discard(self, page_instance_id):
+        """ drop all pending updates for a page, i.e. when the page is closed
+
+            Args:
+                page_instance_id - id of the page
+        """
+        with self._lock:
+            for key in [k for k in self._pending if k[0] == page_instance_id]:
+                del self._pending[key]
+            for key in [k for k in self._last_sent if k[0] == page_instance_id]:
+                del self._last_sent[key]
+            for key in [k for k in self._chart_locks if k[0] == page_instance_id]:
+                del self._chart_locks[key]
+
+    def _delay(self, key):
+        """ return the number of seconds until the chart may be sent again """
+        return max(0, self._last_sent.get(key, 0) + self._interval - time.monotonic())
+
+    def _flush(self, key):
+        """ send the latest pending update for a chart, along with any other charts of the page which are due """
+        with self._lock:
+            if key not in self._pending:
+                self._scheduled.discard(key)
+                return
+
+            # the chart may have been sent early as part of another chart's batch
+            delay = self._delay(key)
+            if delay > 0:
+                self._io_loop.call_later(delay, self._flush, key)
+                return
+
+            # collect every due update of the page so they go out in one message, charts other than this
+            # one still have a flush scheduled which will find nothing pending
+            self._scheduled.discard(key)
+            jsc = self._pending[key][0]
+            updates = {}
+            for k in [k for k in self._pending if (k[0] == key[0]) and (self._delay(k) == 0)]:
+                _, df, kwargs = self._pending.pop(k)
+                self._last_sent[k] = time.monotonic()
+                updates[k[1]] = (df, kwargs)
+
+        try:
+            self._send_func(jsc, updates)
+        except Exception:
+            logging.exception(f'Unable to update charts {list(updates.keys())}')
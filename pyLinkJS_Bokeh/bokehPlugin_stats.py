@@ -0,0 +1,231 @@
+""" statistics on the work done by the Bokeh PyLinkJS plugin """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import collections
+import itertools
+import threading
+import numpy as np
+
+
+# --------------------------------------------------
+#    Constants
+# --------------------------------------------------
+COUNTERS = {'updates': 'number of updates and streams sent',
+            'prep_seconds': 'seconds spent preparing the data',
+            'js_seconds': 'seconds spent generating the javascript',
+            'js_bytes': 'bytes of javascript generated'}
+LATENCY_SAMPLES = 1000          # number of latency samples kept for each chart to calculate the percentiles
+LATENCY_PENDING = 10000         # number of updates waiting for the browser to report their latency
+
+# javascript which times the updates in the browser and reports them back in batches through bokeh_callback.
+# JSON.parse is wrapped while an update runs so the time spent parsing the data can be split from the time
+# spent building the models, and the time until the next animation frame approximates the paint time
+LATENCY_JS = """
+    var bokeh_latency = {current: null, reports: [], timer: null, json_parse: JSON.parse};
+
+    function bokeh_latency_begin(seq) {
+        var current = {seq: seq, start: performance.now(), parse: 0};
+        bokeh_latency.current = current;
+        JSON.parse = function(text, reviver) {
+            var t = performance.now();
+            try {
+                return bokeh_latency.json_parse(text, reviver);
+            } finally {
+                current.parse += performance.now() - t;
+            }
+        };
+    }
+
+    function bokeh_latency_end() {
+        var current = bokeh_latency.current;
+        JSON.parse = bokeh_latency.json_parse;
+        bokeh_latency.current = null;
+        if (current == null) {
+            return;
+        }
+        var end = performance.now();
+        requestAnimationFrame(function() {
+            bokeh_latency.reports.push([current.seq, current.parse, end - current.start - current.parse,
+                                        performance.now() - end]);
+            if (bokeh_latency.reports.length >= 50) {
+                bokeh_latency_flush();
+            } else if (bokeh_latency.timer == null) {
+                bokeh_latency.timer = setTimeout(bokeh_latency_flush, 1000);
+            }
+        });
+    }
+
+    function bokeh_latency_flush() {
+        clearTimeout(bokeh_latency.timer);
+        bokeh_latency.timer = null;
+        if (bokeh_latency.reports.length > 0) {
+            call_py('bokeh_callback', 'latency', bokeh_latency.reports);
+            bokeh_latency.reports = [];
+        }
+    }
+"""
+
+
+# --------------------------------------------------
+#    Classes
+# --------------------------------------------------
+class statsCollector:
+    """ collect counters for each chart type and chart name
+
+        The plugin only calls the collector when statistics are enabled, so there is no cost when disabled
+    """
+    def __init__(self):
+        """ init """
+        self._lock = threading.Lock()
+        self._charts = {}
+        self._latency = {}
+        self._pending = collections.OrderedDict()
+        self._seq = itertools.count()
+
+    def record(self, chart_type, chart_name, prep_seconds, js_seconds, js_bytes):
+        """ record one update of a chart
+
+            Args:
+                chart_type - type of the chart, i.e. 'line'
+                chart_name - name of the chart
+                prep_seconds - seconds spent in _prep_for_chart
+                js_seconds - seconds spent in the update_js or stream_js of the chart type
+                js_bytes - bytes of javascript generated
+        """
+        with self._lock:
+            c = self._charts.get((chart_type, chart_name), None)
+            if c is None:
+                c = dict.fromkeys(COUNTERS, 0)
+                self._charts[(chart_type, chart_name)] = c
+            c['updates'] += 1
+            c['prep_seconds'] += prep_seconds
+            c['js_seconds'] += js_seconds
+            c['js_bytes'] += js_bytes
+
+    def begin_update(self, page_instance_id, chart_type, chart_name, python_seconds):
+        """ assign a sequence id to an update which is about to be sent to the browser
+
+            Args:
+                page_instance_id - id of the page the update is sent to
+                chart_type - type of the chart, i.e. 'line'
+                chart_name - name of the chart
+                python_seconds - seconds spent in python generating the update
+
+            Returns:
+                sequence id of the update, reported back by the browser with the browser timings
+        """
+        with self._lock:
+            seq = next(self._seq)
+            self._pending[(page_instance_id, seq)] = (chart_type, chart_name, python_seconds)
+            if len(self._pending) > LATENCY_PENDING:
+                self._pending.popitem(last=False)
+        return seq
+
+    def record_latency(self, page_instance_id, reports):
+        """ record the browser timings of updates
+
+            The end to end latency of an update is the time spent in python plus the time spent in the browser
+            parsing the data, building the models and until the next animation frame.  The time the update
+            spends on the network is not included
+
+            Args:
+                page_instance_id - id of the page which sent the reports
+                reports - list of [sequence id, parse ms, build ms, frame ms]
+        """
+        with self._lock:
+            for seq, parse_ms, build_ms, frame_ms in reports:
+                update = self._pending.pop((page_instance_id, int(seq)), None)
+                if update is None:
+                    continue
+                chart_type, chart_name, python_seconds = update
+                c = self._latency.get((chart_type, chart_name), None)
+                if c is None:
+                    c = {'count': 0, 'sum': 0.0, 'samples': collections.deque(maxlen=LATENCY_SAMPLES)}
+                    self._latency[(chart_type, chart_name)] = c
+                seconds = python_seconds + (float(parse_ms) + float(build_ms) + float(frame_ms)) / 1000
+                c['count'] += 1
+                c['sum'] += seconds
+                c['samples'].append((seconds, python_seconds, float(parse_ms) / 1000, float(build_ms) / 1000,
+                                     float(frame_ms) / 1000))
+
+    def discard(self, page_instance_id):
+        """ drop the updates of a page still waiting for their latency, i.e. when the page is closed
+
+            Args:
+                page_instance_id - id of the page
+        """
+        with self._lock:
+            for key in [k for k in self._pending if k[0] == page_instance_id]:
+                del self._pending[key]
+
+    def latency(self):
+        """ return the percentiles of the end to end latency of each chart
+
+            Returns:
+                list of dictionaries, one per chart, with chart_type, chart_name, count, sum and the 50th and
+                99th percentile in seconds of the end to end latency and of each part of it
+        """
+        with self._lock:
+            latency = [(k, v['count'], v['sum'], np.array(v['samples'])) for k, v in self._latency.items()]
+
+        result = []
+        for (chart_type, chart_name), count, total, samples in latency:
+            r = {'chart_type': chart_type, 'chart_name': chart_name, 'count': count, 'sum': total}
+            p50, p99 = np.percentile(samples, [50, 99], axis=0)
+            for i, part in enumerate(['', 'python_', 'parse_', 'build_', 'frame_']):
+                r[f'{part}p50'] = p50[i]
+                r[f'{part}p99'] = p99[i]
+            result.append(r)
+        return result
+
+    def snapshot(self):
+        """ return a copy of the counters
+
+            Returns:
+                list of dictionaries, one per chart, with chart_type, chart_name and the counters
+        """
+        with self._lock:
+            return [{'chart_type': k[0], 'chart_name': k[1], **v} for k, v in self._charts.items()]
+
+    def reset(self):
+        """ reset all of the counters """
+        with self._lock:
+            self._charts = {}
+            self._latency = {}
+
+    def openmetrics(self, gauges=None):
+        """ return the counters in the OpenMetrics text format, which Prometheus can scrape
+
+            Args:
+                gauges - dictionary of extra gauge name to (help, value), i.e. the number of page contexts
+
+            Returns:
+                text of the metrics
+        """
+        def escape(s):
+            return str(s).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        charts = self.snapshot()
+        lines = []
+        for name, help_text in COUNTERS.items():
+            lines.append(f'# TYPE bokeh_chart_{name} counter')
+            lines.append(f'# HELP bokeh_chart_{name} {help_text}')
+            for c in charts:
+                labels = f'chart_type="{escape(c["chart_type"])}",chart_name="{escape(c["chart_name"])}"'
+                lines.append(f'bokeh_chart_{name}_total{{{labels}}} {c[name]}')
+        lines.append('# TYPE bokeh_chart_latency_seconds summary')
+        lines.append('# HELP bokeh_chart_latency_seconds end to end latency of updates, excluding the network')
+        for c in self.latency():
+            labels = f'chart_type="{escape(c["chart_type"])}",chart_name="{escape(c["chart_name"])}"'
+            lines.append(f'bokeh_chart_latency_seconds{{{labels},quantile="0.5"}} {c["p50"]}')
+            lines.append(f'bokeh_chart_latency_seconds{{{labels},quantile="0.99"}} {c["p99"]}')
+            lines.append(f'bokeh_chart_latency_seconds_count{{{labels}}} {c["count"]}')
+            lines.append(f'bokeh_chart_latency_seconds_sum{{{labels}}} {c["sum"]}')
+        for name, (help_text, value) in (gauges or {}).items():
+            lines.append(f'# TYPE bokeh_{name} gauge')
+            lines.append(f'# HELP bokeh_{name} {help_text}')
+            lines.append(f'bokeh_{name} {value}')
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
@@ -3,10 +3,13 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
+import html
 import json
+import numpy as np
+import pandas as pd
 import bokeh.embed
 import bokeh.models
-from .bokehPlugin_util import promote_kwargs_prefix
+from .bokehPlugin_util import DECODE_TYPED_ARRAY_JS, cds_data_js, find_figure_js, promote_kwargs_prefix, update_figure_data
 
 
 # --------------------------------------------------
@@ -31,8 +34,139 @@ def create_chart_js(pv):
         Returns:
             javascript to create the initial chart
     """
-    # table creation is done all within update_chart_js
-    return ''
+    # table creation is done all within update_chart_js, except for the pager of server side tables
+    if not pv['kwargs'].get('server_side', False):
+        return ''
+
+    name = pv['figure_kwargs']['name']
+    pager_html = f"""
+        <div id="{pv['div_id']}_pager" data-page="0">
+            <button onclick="call_py('bokeh_callback', 'table_page', '{name}', parseInt(this.parentNode.dataset.page) - 1);">&lt;</button>
+            <span class="pager_label"></span>
+            <button onclick="call_py('bokeh_callback', 'table_page', '{name}', parseInt(this.parentNode.dataset.page) + 1);">&gt;</button>
+            <select class="pager_sort" onchange="call_py('bokeh_callback', 'table_sort', '{name}', this.value);"></select>
+            <input class="pager_filter" type="text" placeholder="filter"
+                   onchange="call_py('bokeh_callback', 'table_filter', '{name}', this.value);">
+        </div>"""
+    return f"""$('#{pv['div_id']}').after({json.dumps(pager_html)});"""
+
+
+def create_table_view_df(df, view):
+    """ filter and sort the full dataframe of a server side table
+
+        Args:
+            df - full dataframe of the table
+            view - dictionary describing the view of the table
+                    'filter' - rows which contain this text in any text column, or equal it in any numeric
+                               column, are kept.  Text is matched case insensitive
+                    'sort' - name of the column to sort on, or '' to keep the order of the dataframe
+                    'ascending' - if False, sort descending
+
+        Returns:
+            dataframe with the rows of the view in order
+    """
+    if view['filter']:
+        try:
+            number = float(view['filter'])
+        except ValueError:
+            number = None
+        mask = np.zeros(len(df), dtype=bool)
+        for c in df.columns:
+            if pd.api.types.is_numeric_dtype(df[c]):
+                if number is not None:
+                    mask |= (df[c] == number).to_numpy()
+            else:
+                mask |= df[c].astype(str).str.contains(view['filter'], case=False, regex=False).to_numpy()
+        df = df[mask]
+    if view['sort']:
+        df = df.sort_values(view['sort'], ascending=view['ascending'], kind='stable')
+    return df
+
+
+def page_chart_js(pv):
+    """ send the current page of a server side table to the browser
+
+        Only the rows of the current page are sent.  The filtered and sorted view of the full dataframe is
+        kept in the chart state so changing the page does not filter or sort again.
+
+        Args:
+            pv - see create_chart_js documentation for pv documentation
+                    'state'
+                        'table_df' - full dataframe of the table
+                        'table_view' - page, sort and filter of the table, see create_table_view_df
+                        'table_view_df' - filtered and sorted dataframe, None if it must be recalculated
+
+        Returns:
+            javascript to update the table and the pager
+    """
+    state = pv['state']
+    view = state.setdefault('table_view', {'page': 0, 'sort': '', 'ascending': True, 'filter': ''})
+    if state.get('table_view_df', None) is None:
+        state['table_view_df'] = create_table_view_df(state.get('table_df', pv['df']), view)
+    df = state['table_view_df']
+
+    # clamp the page to the rows available
+    page_size = int(pv['kwargs'].get('page_size', 100))
+    n_pages = max(1, -(-len(df) // page_size))
+    view['page'] = min(max(0, view['page']), n_pages - 1)
+    start = view['page'] * page_size
+    page_df = df.iloc[start:start + page_size]
+
+    # sort choices for every column in both directions
+    columns = [str(df.index.name)] + [str(c) for c in df.columns]
+    options = [('', '', 'unsorted')]
+    for c in columns:
+        options.append((f'{c}|asc', c if view['ascending'] else None, f'{c} ascending'))
+        options.append((f'{c}|desc', c if not view['ascending'] else None, f'{c} descending'))
+    options_html = ''.join([f'<option value="{html.escape(v)}"{" selected" if s == view["sort"] else ""}>'
+                            f'{html.escape(t)}</option>' for v, s, t in options])
+    label = f'rows {start + 1 if len(page_df) > 0 else 0:,}-{start + len(page_df):,} of {len(df):,}'
+
+    js = update_table_js(pv, page_df)
+    js += f""" var pager = document.getElementById('{pv['div_id']}_pager');
+              if (pager != null) {{
+                  pager.dataset.page = {view['page']};
+                  pager.querySelector('.pager_label').textContent = {json.dumps(label)};
+                  pager.querySelector('.pager_sort').innerHTML = {json.dumps(options_html)};
+              }} \n"""
+    return js
+
+
+def table_callback_js(pv, action, value):
+    """ change the page, sort or filter of a server side table in response to the pager in the browser
+
+        Args:
+            pv - see create_chart_js documentation for pv documentation
+            action - 'table_page', 'table_sort' or 'table_filter'
+            value - page number for table_page
+                    column name followed by |asc or |desc for table_sort, or '' to remove sorting
+                    text to filter on for table_filter
+
+        Returns:
+            javascript to update the table and the pager
+
+        Raises:
+            ValueError if the action or value sent by the browser is not valid, the view is left unchanged
+    """
+    view = pv['state'].setdefault('table_view', {'page': 0, 'sort': '', 'ascending': True, 'filter': ''})
+    if action == 'table_page':
+        view['page'] = int(value)
+    elif action == 'table_sort':
+        column, _, direction = str(value).partition('|')
+        df = pv['state'].get('table_df', pv['df'])
+        if column and (column not in [str(df.index.name)] + [str(c) for c in df.columns]):
+            raise ValueError(f'Unknown sort column "{column}"')
+        view['sort'] = column
+        view['ascending'] = direction != 'desc'
+        view['page'] = 0
+        pv['state']['table_view_df'] = None
+    elif action == 'table_filter':
+        view['filter'] = str(value)
+        view['page'] = 0
+        pv['state']['table_view_df'] = None
+    else:
+        raise ValueError(f'Unknown table action "{action}"')
+    return page_chart_js(pv)
 
 
 def update_chart_js(pv):
@@ -44,7 +178,44 @@ def update_chart_js(pv):
         Returns:
             javascript to update the chart with new data
     """
-    df = pv['df']
+    # server side tables keep the full dataframe and only send the current page
+    if pv['kwargs'].get('server_side', False):
+        # a real copy, pv['df'] shares its data with the dataframe passed in which the caller may modify
+        pv['state']['table_df'] = pv['df'].copy()
+        pv['state']['table_view_df'] = None
+        return page_chart_js(pv)
+    return update_table_js(pv, pv['df'])
+
+
+def update_table_js(pv, df):
+    """ update the table in the browser with new data
+
+        Args:
+            pv - see create_chart_js documentation for pv documentation
+            df - dataframe to show in the table
+
+        Returns:
+            javascript to update the table
+    """
+    # update the data in place if the table already in the browser can be reused
+    js = update_figure_data(df, pv['figure_kwargs']['name'], pv['state'], source_js='f.source',
+                            transport=pv['kwargs'].get('transport', 'json'))
+    if js is not None:
+        return js
+
+    # the columns changed, replace the columns and the data of the table already in the browser
+    if pv['state'].get('embedded', False):
+        transport = pv['kwargs'].get('transport', 'json')
+        js = DECODE_TYPED_ARRAY_JS if transport == 'binary' else ''
+        js += find_figure_js(pv['figure_kwargs']['name'])
+        js += f""" if (f != null) {{
+                      f.columns = JSON.parse('{json.dumps([str(c) for c in df.columns])}').map(
+                          (c) => new Bokeh.Tables.TableColumn({{field: c, title: c}}));
+                      f.source.data = {cds_data_js(pv['state']['cds_df'], transport, reset_index=False)};
+                  }} \n"""
+        return js
+    pv['state']['embedded'] = True
+
     cds = bokeh.models.ColumnDataSource(df)
     
     # plot the table
@@ -53,6 +224,10 @@ def update_chart_js(pv):
     table_kwargs.update(promote_kwargs_prefix(['__table__'], pv['kwargs']))
     table_kwargs['columns'] = [bokeh.models.widgets.TableColumn(field=Ci, title=Ci) for Ci in df.columns]
     
+    # sorting in the browser would only sort the current page of a server side table
+    if pv['kwargs'].get('server_side', False):
+        table_kwargs.setdefault('sortable', False)
+
     # DataTable does not accept title parameter, so remove
     if 'title' in table_kwargs:
         del table_kwargs['title']
@@ -1,5 +1,26 @@
+import base64
 import bokeh.palettes
 import json
+import threading
+import numpy as np
+import pandas as pd
+
+
+# palettes already generated, (id of the user palette, colors needed) -> (user palette, palette).  The user
+# palette is kept in the value so its id can not be reused by another object while it is cached
+PALETTE_CACHE = {}
+PALETTE_CACHE_MAX_SIZE = 256
+_PALETTE_CACHE_LOCK = threading.Lock()
+
+# javascript helper to decode a base64 little endian buffer of float64 into a typed array
+DECODE_TYPED_ARRAY_JS = """ function bokeh_decode_typed_array(s) {
+                                var b = atob(s);
+                                var u = new Uint8Array(b.length);
+                                for (var i = 0; i < b.length; i++) {
+                                    u[i] = b.charCodeAt(i);
+                                }
+                                return new Float64Array(u.buffer);
+                            } \n"""
 
 
 
@@ -13,43 +34,146 @@ def configure_color_palette(df, user_palette=None):
         Returns:
             a normalized palette large enough to color the data
     """
-    # setup the base palette
-    if user_palette is None:
-        user_palette = bokeh.palettes.Category10
-    else:
-        user_palette = {len(user_palette): user_palette}
-
     # calculate colors needed
-    colors_needed = 0
-    for c in df.columns.map(str):
-        if not c.startswith('_'):
-            colors_needed = colors_needed + 1
+    colors_needed = sum([not str(c).startswith('_') for c in df.columns])
+
+    # reuse the palette if it was already generated for this user palette and number of colors
+    key = (id(user_palette), colors_needed)
+    with _PALETTE_CACHE_LOCK:
+        cached = PALETTE_CACHE.get(key, None)
+    if (cached is not None) and (cached[0] is user_palette):
+        return list(cached[1])
+
+    # setup the base palette
+    base_palette = bokeh.palettes.Category10 if user_palette is None else {len(user_palette): user_palette}
 
     # calculate best color range in palette
-    cr_min = sorted(user_palette.keys())[0]
-    cr_max = sorted(user_palette.keys())[-1]
-    color_range = min(cr_max, max(cr_min, colors_needed))
+    color_range = min(max(base_palette.keys()), max(min(base_palette.keys()), colors_needed))
+    colors = base_palette[color_range]
 
-    # calculate number of colors available in that color range
-    cr_colors_available = len(user_palette[color_range])
+    # generate palette by repeating the colors in the color range as many times as needed
+    palette = (list(colors) * (colors_needed // len(colors) + 1))[:colors_needed]
 
-    # generate palette
-    palette = []
-    for i in range(0, colors_needed):
-        palette.append(user_palette[color_range][i % cr_colors_available])
+    # cache the palette, the cache is cleared when full since only a few palettes are used at once
+    with _PALETTE_CACHE_LOCK:
+        if len(PALETTE_CACHE) >= PALETTE_CACHE_MAX_SIZE:
+            PALETTE_CACHE.clear()
+        PALETTE_CACHE[key] = (user_palette, tuple(palette))
 
     # success!
     return palette
 
 
-def reset_figure(df, chart_name, no_legend=False):
-    cds_data_json = json.dumps(df.reset_index().to_dict(orient='list'))
-    js = f""" var plt = Bokeh.Plotting;
-              var data_json = JSON.parse('{cds_data_json}');
-              var cds = new Bokeh.ColumnDataSource({{'data': data_json}}); \n"""
+def json_values(values):
+    """ convert the values of a column into a list which json.dumps writes as valid JSON
 
-    # search for the figure
-    js += f""" var f_name = '';
+        datetimes are converted to milliseconds after epoch, the same as the binary transport sends them, and
+        missing values are converted to null since JSON.parse does not accept NaN
+
+        Args:
+            values - numpy array of the values
+
+        Returns:
+            list of the values
+    """
+    missing = pd.isna(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype('datetime64[ms]').astype(np.int64)
+    if not missing.any():
+        return values.tolist()
+    values = values.astype(object)
+    values[missing] = None
+    return values.tolist()
+
+
+def cds_data_js(df, transport='json', reset_index=True):
+    """ return a javascript expression which evaluates to the data for a ColumnDataSource
+
+        Args:
+            df - dataframe containing the data, the index is sent as a column
+            transport - 'json' to send all columns as a JSON string
+                        'binary' to send numeric columns as base64 encoded little endian buffers which are
+                        decoded into Float64Array columns in the browser.  Integer columns are sent as float64
+                        too, since later patches and streams write into the same typed array and would be
+                        truncated or wrap around in a narrower one.  Columns which are not
+                        numeric are still sent as JSON.  datetime columns are sent as milliseconds after epoch.
+                        The javascript from DECODE_TYPED_ARRAY_JS must be included before the expression
+            reset_index - False if the index of df was already reset, i.e. the data remembered by
+                          update_figure_data, to avoid copying the dataframe again
+
+        Returns:
+            javascript expression for the data
+    """
+    data = df.reset_index() if reset_index else df
+    if transport != 'binary':
+        return f"""JSON.parse('{json.dumps(data.to_dict(orient='list'))}')"""
+
+    columns = []
+    for c in data.columns:
+        values = data[c].to_numpy()
+        if np.issubdtype(values.dtype, np.datetime64):
+            values = values.astype('datetime64[ms]').astype(np.int64).astype('<f8')
+        if np.issubdtype(values.dtype, np.integer) or np.issubdtype(values.dtype, np.floating):
+            values = np.ascontiguousarray(values, dtype='<f8')
+        else:
+            columns.append(f"""{json.dumps(str(c))}: JSON.parse('{json.dumps(json_values(values))}')""")
+            continue
+        b64 = base64.b64encode(values.tobytes()).decode('ascii')
+        columns.append(f"""{json.dumps(str(c))}: bokeh_decode_typed_array('{b64}')""")
+    return '{' + ', '.join(columns) + '}'
+
+
+def downsample_min_max(df, max_points):
+    """ downsample the rows of a dataframe while keeping the shape of every column visible
+
+        The rows are split into buckets, and in each bucket the rows holding the min and the max of every
+        numeric column are kept.  The first and last rows are always kept.  Because all columns share the
+        index, the kept rows are the union over the columns, so the number of buckets is max_points / 2
+        divided by the number of numeric columns to keep about max_points rows in total.  If there are too
+        many columns to keep the min and max of each, evenly spaced rows are kept instead
+
+        Args:
+            df - dataframe to downsample
+            max_points - number of rows to keep, None to disable downsampling
+
+        Returns:
+            downsampled dataframe, or df itself if it already has max_points rows or less
+    """
+    n = len(df)
+    if (max_points is None) or (n <= max_points):
+        return df
+
+    values = df.select_dtypes('number').to_numpy(dtype=float)
+    n_buckets = int(max_points) // (2 * max(1, values.shape[1]))
+    if (values.shape[1] == 0) or (n_buckets == 0):
+        # nothing to measure, keep evenly spaced rows
+        rows = np.linspace(0, n - 1, int(max_points)).astype(int)
+    else:
+        # divide the rows into equally sized buckets
+        bucket_size = -(-n // n_buckets)
+        n_buckets = -(-n // bucket_size)
+
+        # find the min and max row of each column in each bucket, padding the last bucket with NaN
+        values = np.pad(values, ((0, n_buckets * bucket_size - n), (0, 0)), constant_values=np.nan)
+        values = values.reshape(n_buckets, bucket_size, values.shape[1])
+        missing = np.isnan(values)
+        row_min = np.where(missing, np.inf, values).argmin(axis=1)
+        row_max = np.where(missing, -np.inf, values).argmax(axis=1)
+        bucket_start = (np.arange(n_buckets) * bucket_size)[:, None]
+        rows = np.concatenate([(bucket_start + row_min).ravel(), (bucket_start + row_max).ravel(), [0, n - 1]])
+    return df.iloc[np.unique(rows)]
+
+
+def find_figure_js(chart_name):
+    """ return javascript which points the variable f at the figure for the chart
+
+        Args:
+            chart_name - name of the chart to search the bokeh documents for
+
+        Returns:
+            javascript to locate the figure
+    """
+    return f""" var f_name = '';
                try {{
                    f_name = f.name;
                }} catch {{
@@ -63,6 +187,16 @@ def reset_figure(df, chart_name, no_legend=False):
                    }}
                }} \n"""
 
+
+def reset_figure(df, chart_name, no_legend=False, transport='json', reset_index=True):
+    js = DECODE_TYPED_ARRAY_JS if transport == 'binary' else ''
+    js += f""" var plt = Bokeh.Plotting;
+              var data_json = {cds_data_js(df, transport, reset_index)};
+              var cds = new Bokeh.ColumnDataSource({{'data': data_json}}); \n"""
+
+    # search for the figure
+    js += find_figure_js(chart_name)
+
     legend_pop = """f.legend.items.pop();"""
     legend_change = """f.legend.change.emit();"""
     if no_legend:
@@ -79,6 +213,118 @@ def reset_figure(df, chart_name, no_legend=False):
     return js
 
 
+def diff_cds_data(data_old, data_new):
+    """ compute the cells which changed between two versions of the data for a ColumnDataSource
+
+        Args:
+            data_old - dataframe of the data previously sent to the browser
+            data_new - dataframe of the data about to be sent to the browser
+
+        Returns:
+            dictionary of column name to a list of [row, new value] pairs in the format expected by
+            ColumnDataSource.patch, or None if the columns or number of rows changed.  The new values are
+            converted with json_values
+    """
+    if (data_old is None) or (not data_old.columns.equals(data_new.columns)) or (len(data_old) != len(data_new)):
+        return None
+
+    patches = {}
+    for c in data_new.columns:
+        old_values = data_old[c].to_numpy()
+        new_values = data_new[c].to_numpy()
+        changed = (old_values != new_values) & ~(pd.isna(old_values) & pd.isna(new_values))
+        rows = changed.nonzero()[0]
+        if len(rows) > 0:
+            patches[str(c)] = [list(x) for x in zip(rows.tolist(), json_values(new_values[rows]))]
+    return patches
+
+
+def update_figure_data(df, chart_name, state, source_js=None, transport='json'):
+    """ update the ColumnDataSource already attached to the figure without rebuilding the glyphs
+
+        If the columns and number of rows have not changed since the last update, only the changed cells
+        are sent as a patch.  If the number of rows changed, or most of the cells changed, the data of the
+        ColumnDataSource is replaced in place.  The figure, glyphs and legend are left alive either way.
+        The dataframe sent to the browser is remembered in the chart state so the next update can be
+        compared against it
+
+        Args:
+            df - dataframe for the chart, in the same form that is passed to reset_figure
+            chart_name - name of the chart to update
+            state - dictionary of state kept for the chart between updates
+            source_js - javascript expression for the ColumnDataSource to update, default is the data
+                        source of the first renderer on the figure
+            transport - 'json' or 'binary', see cds_data_js
+
+        Returns:
+            javascript to update the chart data, or None if the columns changed and the figure must be reset
+    """
+    data = df.reset_index()
+    data_old = state.get('cds_df', None)
+    state['cds_df'] = data
+    if (data_old is None) or (not data_old.columns.equals(data.columns)):
+        return None
+
+    if source_js is None:
+        source_js = 'f.renderers.length > 0 ? f.renderers[0].data_source : null'
+
+    js = find_figure_js(chart_name)
+    patches = diff_cds_data(data_old, data)
+    if (patches is not None) and (sum([len(v) for v in patches.values()]) * 2 <= data.size):
+        # patch the changed cells
+        if patches:
+            js += f""" var patches_json = JSON.parse('{json.dumps(patches)}');
+                      var source = {source_js};
+                      if (source != null) {{
+                          source.patch(patches_json);
+                      }} \n"""
+    else:
+        # replace the data
+        if transport == 'binary':
+            js += DECODE_TYPED_ARRAY_JS
+        js += f""" var source = {source_js};
+                  if (source != null) {{
+                      source.data = {cds_data_js(data, transport, reset_index=False)};
+                  }} \n"""
+    return js
+
+
+def stream_figure(df, chart_name, rollover=None, transport='json', state=None):
+    """ append rows to the ColumnDataSource already attached to the figure
+
+        Args:
+            df - dataframe containing only the new rows
+            chart_name - name of the chart to stream to
+            rollover - maximum number of rows to keep in the browser, None keeps everything
+            transport - 'json' or 'binary', see cds_data_js.  must match the transport used to reset the figure
+            state - dictionary of state kept for the chart between updates.  If set, the new rows are also
+                    appended to the data remembered by update_figure_data, so the next update can still be
+                    sent as a patch
+
+        Returns:
+            javascript to stream the new rows
+    """
+    data = df.reset_index()
+    if state is not None:
+        data_old = state.get('cds_df', None)
+        if (data_old is not None) and data_old.columns.equals(data.columns):
+            data_all = pd.concat([data_old, data], ignore_index=True)
+            if rollover is not None:
+                data_all = data_all.iloc[max(0, len(data_all) - int(rollover)):].reset_index(drop=True)
+            state['cds_df'] = data_all
+        else:
+            state.pop('cds_df', None)
+
+    rollover = 'null' if rollover is None else int(rollover)
+    js = DECODE_TYPED_ARRAY_JS if transport == 'binary' else ''
+    js += f""" var data_json = {cds_data_js(data, transport, reset_index=False)}; \n"""
+    js += find_figure_js(chart_name)
+    js += f""" if (f.renderers.length > 0) {{
+                  f.renderers[0].data_source.stream(data_json, {rollover});
+              }} \n"""
+    return js
+
+
 def promote_kwargs_prefix(prefixes, kwargs):
     """ return keyword args that start with a prefix.  the returned dictionary will have the prefix strippped
 
@@ -1,18 +1,139 @@
-    # @classmethod
-    # def _create_varea_chart_data(cls, pv):
-    #     return {'cds': bokeh.models.ColumnDataSource(pv['df'])}
-    #
-    # @classmethod
-    # def _create_varea_chart(cls, pv, **kwargs):
-    #     """ Create a vertical stacked area chart """
-    #     # create the data
-    #     data = cls._create_varea_chart_data(pv)
-    #
-    #     # create the figure
-    #     p = bokeh.plotting.figure(**pv['figure_kwargs'])
-    #
-    #     # create the vertical area
-    #     p.varea_stack(stackers=pv['df'].columns, x='X', source=data['cds'], color=pv['palette'], legend_label=[str(c) for c in pv['df'].columns])
-    #
-    #     # success!
-    #     return p
+""" functions to create a stacked vertical area chart for the Bokeh PyLinkeJS plugin """
+
+# --------------------------------------------------
+#    Imports
+# --------------------------------------------------
+import numpy as np
+import pandas as pd
+from .bokehPlugin_util import post_process_figure, promote_kwargs_prefix, reset_figure, stream_figure, update_figure_data
+
+
+# --------------------------------------------------
+#    Functions
+# --------------------------------------------------
+def create_chart_df(df):
+    """ stack the columns of the dataframe on top of each other
+
+        The top of every area is computed with one cumulative sum across the columns, the bottom of an area
+        is the top of the area below it.  Each row is stacked on its own, so new rows can be stacked without
+        the rows already on the chart.  Missing values are stacked as 0
+
+        Args:
+            df - dataframe passed in by user, see update_chart_js
+
+        Returns:
+            dataframe with the top of the stack for each column of the input dataframe
+
+                __top_0  __top_1
+            X
+            0      58.0     63.0
+            1      51.0    136.0
+    """
+    tops = np.cumsum(np.nan_to_num(df.to_numpy(dtype=float)), axis=1)
+    return pd.DataFrame(tops, index=df.index, columns=[f'__top_{i}' for i in range(len(df.columns))])
+
+
+def create_chart_js(pv):
+    """ Create the javascript to create a chart
+
+        Args:
+            target_div_id - id of the div which will contain the chart
+            pv - dict of prepared values
+                    'df' - dataframe passed in by user
+                    'div_id' - id of the div to target
+                    'figure_kwargs' - keyword args passed in that affect figure creation
+                        'name' - name of the chart
+                        (see bokeh Figure documentation for full list)
+                    'kwargs' - keyword arguments passed in during initial chart creation
+                        (keyword args prefaced with __varea__ will be passed in for varea creation.
+                         see Bokeh varea documentation for full list of available keywords)
+                    'palette' - color palette to use for chart rendering
+
+        Returns:
+            javascript to create the initial chart
+    """
+    js = f"""
+        var plt = Bokeh.Plotting;
+        var f = new plt.Figure({pv['figure_kwargs']});
+        """
+    js += post_process_figure(**pv['kwargs'])
+    js += update_chart_js(pv)
+    js += f"""plt.show(f, '#{pv["div_id"]}');"""
+    return js
+
+
+def update_chart_js(pv):
+    """ update the chart with new data
+
+            Dataframe Input
+
+                - A, B, C are the names of the areas, stacked from the bottom up
+                - 0, 1, 2 is the X axis
+                - cell values are the height of each area
+
+                    A   B   C
+                0  58   5  51
+                1  51  85  83
+                2   5  70  95
+
+        Args:
+            pv - see create_chart_js documentation for pv documentation
+
+        Returns:
+            javascript to update the chart with new data
+    """
+    df = create_chart_df(pv['df'])
+
+    # the columns of the data are numbered, so the legend must be rebuilt if the areas were renamed
+    if pv['state'].get('series') != list(pv['df'].columns):
+        pv['state'].pop('cds_df', None)
+    pv['state']['series'] = list(pv['df'].columns)
+
+    # update the data in place if the areas on the figure can be reused
+    js = update_figure_data(df, pv['figure_kwargs']['name'], pv['state'],
+                            transport=pv['kwargs'].get('transport', 'json'))
+    if js is not None:
+        return js
+
+    # reset the figure
+    js = reset_figure(pv['state']['cds_df'], pv['figure_kwargs']['name'], reset_index=False,
+                      transport=pv['kwargs'].get('transport', 'json'))
+
+    # add one area per column, all sharing the same data source
+    js += """
+        var items = [];
+    """
+    for i, c in enumerate(pv['df'].columns):
+        kwd = {}
+        kwd['source'] = 'cds'
+        kwd['x'] = "{field: 'X'}"
+        kwd['y1'] = f"{{field: '__top_{i - 1}'}}" if i > 0 else 0
+        kwd['y2'] = f"{{field: '__top_{i}'}}"
+        kwd['fill_color'] = f"'{pv['palette'][i]}'"
+        kwd.update(promote_kwargs_prefix(['__varea__', f'__varea_{i}__'], pv['kwargs']))
+        kwds = ', '.join([f"'{k}': {v}" for k, v in kwd.items()])
+
+        js += f"""
+            var vo = f.varea({{ {kwds} }});
+            items.push(new Bokeh.LegendItem({{label: '{c}', renderers: [vo]}}));
+        """
+
+    # add all of the legend items at once, the top area is listed first like the stack
+    js += """
+        f.legend.items = items.reverse();
+    """
+    return js
+
+
+def stream_chart_js(pv, rollover=None):
+    """ append new rows to the areas already on the chart
+
+        Args:
+            pv - see create_chart_js documentation for pv documentation, 'df' contains only the new rows
+            rollover - maximum number of rows to keep in the browser, None keeps everything
+
+        Returns:
+            javascript to stream the new rows into the chart
+    """
+    return stream_figure(create_chart_df(pv['df']), pv['figure_kwargs']['name'], rollover,
+                         transport=pv['kwargs'].get('transport', 'json'), state=pv['state'])
@@ -3,15 +3,17 @@
 # --------------------------------------------------
 #    Imports
 # --------------------------------------------------
-import bokeh.models
-from .bokehPlugin_util import post_process_figure, promote_kwargs_prefix, reset_figure
+import json
+import numpy as np
+import pandas as pd
+from .bokehPlugin_util import post_process_figure, promote_kwargs_prefix, reset_figure, update_figure_data
 
 
 # --------------------------------------------------
 #    Functions
 # --------------------------------------------------
-def create_chart_factors_cds(pv, flip_factors):
-    """ create a set of factors and the corresponding ColumnDataSource
+def create_chart_factors_df(pv, flip_factors):
+    """ create a set of factors and the corresponding data with one row per bar
     
         Input DataFrame
         
@@ -30,51 +32,46 @@ def create_chart_factors_cds(pv, flip_factors):
     
         Returns:
             factors built up from the dataframe.  i.e. [(0, A), (0, B), (0,C), (1, A) ...]
-            ColumnDataSource with the data rearranged so there is one data point per factor
-                {'factors': [('0', 'A'), ('0', 'B'), ('0', 'C') ...],
-                 'counts': [51, 43, 79 ...],
-                 'line_color': ['#1f77b4', '#ff7f0e', '#2ca02c' ...],
-                 'fill_color': ['#1f77b4', '#ff7f0e', '#2ca02c' ...]}
+            if the dataframe only has one column the factors are the index.  i.e. [0, 1, 2]
+            DataFrame with the data rearranged so there is one row per factor
+                   factors  counts line_color fill_color
+                0  (0, A)      25    #1f77b4    #1f77b4
+                1  (0, B)      13    #ff7f0e    #ff7f0e
+                2  (0, C)       8    #2ca02c    #2ca02c
+                ...
     """
-    if pv['df'].empty:
-        return [], bokeh.models.ColumnDataSource()
-
-    # init
-    data = {}
-
-    # convert
-    df = pv['df'].copy()
-    df.index = df.index.map(str)
-
-    # build the factors
-    data['factors'] = [(x, c) for x in df.index for c in df.columns]
-    if flip_factors:
-        data['factors'] = data['factors'][::-1]
-
-    # build the data
-    counts = []
-    fill_color = []
-    line_color = []
-    for i, f in enumerate(data['factors']):
-        idx = f[0]
-        c = f[1]
-        counts.append(df.loc[idx, c])
-        nc = len(df.columns)
-        if flip_factors:
-            fill_color.append(pv['palette'][nc - 1 - (i % nc)])
-            line_color.append(pv['palette'][nc - 1 - (i % nc)])
+    df = pv['df']
+    if df.empty:
+        return [], pd.DataFrame({'factors': [], 'counts': [], 'line_color': [], 'fill_color': []})
+
+    # one bar per cell, in row major order.  the factors only depend on the index and columns, so the factors
+    # of the last update are reused if they have not changed
+    nr, nc = df.shape
+    cached = pv['state'].get('factors_source', None)
+    if (cached is not None) and (cached[0].equals(df.index)) and (cached[1].equals(df.columns)):
+        factors = cached[2]
+    else:
+        index = df.index.map(str).to_numpy()
+        if nc == 1:
+            factors = index.tolist()
         else:
-            fill_color.append(pv['palette'][i % nc])
-            line_color.append(pv['palette'][i % nc])
+            factors = list(zip(np.repeat(index, nc).tolist(), np.tile(df.columns.to_numpy(), nr).tolist()))
+        pv['state']['factors_source'] = (df.index, df.columns, factors)
+    counts = df.to_numpy().ravel()
+    colors = np.tile(np.asarray(pv['palette'][:nc], dtype=object), nr)
 
-    if len(df.columns) == 1:
-        data['factors'] = [x[0] for x in data['factors']]
+    # flipping reverses the bars, each bar keeps the color of its column
+    if flip_factors:
+        factors = factors[::-1]
+        counts = counts[::-1]
+        colors = colors[::-1]
 
-    data['cds'] = bokeh.models.ColumnDataSource({'factors': data['factors'], 'counts': counts,
-                                                 'line_color': line_color, 'fill_color': fill_color})
+    data = pd.DataFrame({'counts': counts, 'line_color': colors, 'fill_color': colors})
+    data.insert(0, 'factors', pd.Series(factors, dtype=object))
 
     # success!
-    return data['factors'], data['cds']
+    return factors, data
+
 
 def create_chart_js(pv):
     """ Create the javascript to create a chart
@@ -114,14 +111,24 @@ def update_chart_js(pv):
         Returns:
             javascript to update the chart with new data
     """    
-    factors, cds = create_chart_factors_cds(pv, flip_factors=pv['kwargs'].get('flip_factors', False))
-    df = cds.to_df()
-    
-    js = reset_figure(df, pv['figure_kwargs']['name'])
-
-    # rebuilt the y_range factors
-    factors_str = [[x[0], x[1]] for x in factors]
-    js += f"""f.x_range.factors = {factors_str};"""
+    factors, df = create_chart_factors_df(pv, flip_factors=pv['kwargs'].get('flip_factors', False))
+
+    # update the data in place if the bars on the figure can be reused
+    data_js = update_figure_data(df, pv['figure_kwargs']['name'], pv['state'],
+                                  transport=pv['kwargs'].get('transport', 'json'))
+    if data_js is None:
+        js = reset_figure(pv['state']['cds_df'], pv['figure_kwargs']['name'], reset_index=False,
+                          transport=pv['kwargs'].get('transport', 'json'))
+    else:
+        js = data_js
+
+    # rebuilt the x_range factors if they changed
+    if (data_js is None) or (pv['state'].get('factors') != factors):
+        factors_str = json.dumps([list(x) if isinstance(x, tuple) else x for x in factors])
+        js += f"""f.x_range.factors = {factors_str};"""
+    pv['state']['factors'] = factors
+    if data_js is not None:
+        return js
 
     kwd = {}
     kwd['source'] = 'cds'